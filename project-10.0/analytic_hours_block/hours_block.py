@@ -27,119 +27,211 @@ class AccountHoursBlock(orm.Model):
     _inherit = ['mail.thread']
 
     def _get_last_action(self, cr, uid, ids, name, arg, context=None):
-        """ Return the last analytic line date for an invoice"""
-        res = {}
-        for block in self.browse(cr, uid, ids, context=context):
-            cr.execute("SELECT max(al.date) FROM account_analytic_line AS al"
-                       " WHERE al.invoice_id = %s", (block.invoice_id.id,))
-            fetch_res = cr.fetchone()
-            res[block.id] = fetch_res[0] if fetch_res else False
+        """ Return the last analytic line date for the blocks invoices,
+        with a single grouped query """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        res = dict.fromkeys(ids, False)
+        if not ids:
+            return res
+        cr.execute("SELECT b.id, max(al.date) "
+                   "FROM account_hours_block AS b "
+                   "JOIN account_analytic_line AS al "
+                   "     ON al.invoice_id = b.invoice_id "
+                   "WHERE b.id IN %s "
+                   "GROUP BY b.id", (tuple(ids),))
+        for block_id, last_date in cr.fetchall():
+            res[block_id] = last_date or False
+        return res
+
+    def _get_invoicing_factor_table(self, cr, uid):
+        """ Return the table of the analytic lines invoicing factors """
+        aal_obj = self.pool.get('account.analytic.line')
+        return self.pool[aal_obj._columns['to_invoice']._obj]._table
+
+    def _get_bought(self, cr, uid, ids, block_type, context=None):
+        """
+        Return the quantity or amount bought for each block, computed from
+        the lines of the blocks invoices with a single grouped query:
+        quantities of products accounted for hours blocks for the "hours"
+        type, line amounts for the "amount" type, in the base UoM.
+        """
+        res = dict.fromkeys(ids, 0.0)
+        if block_type == 'hours':
+            value = "il.quantity"
+            where = "AND pp.is_in_hours_block"
+        else:
+            value = "il.quantity * il.price_unit"
+            where = ""
+        cr.execute("SELECT b.id, "
+                   "       sum(" + value + " / "
+                   "           coalesce(nullif(uos.factor, 0.0), 1.0)) "
+                   "FROM account_hours_block AS b "
+                   "JOIN account_invoice_line AS il "
+                   "     ON il.invoice_id = b.invoice_id "
+                   "JOIN product_product AS pp ON pp.id = il.product_id "
+                   "LEFT JOIN product_uom AS uos ON uos.id = il.uos_id "
+                   "WHERE b.id IN %s " + where + " "
+                   "GROUP BY b.id", (tuple(ids),))
+        for block_id, bought in cr.fetchall():
+            res[block_id] = bought or 0.0
         return res
 
+    def _get_hours_used(self, cr, uid, block_ids=None, line_ids=None,
+                        context=None):
+        """
+        Return the hours spent on blocks, from the analytic lines generated
+        from timesheet associated to the blocks invoices, in the base UoM,
+        as a dict {block_id: hours}.
+        Restricted to the given ``block_ids``, or to the hours blocks of
+        the given analytic ``line_ids``, counting those lines only.
+        """
+        where, params = [], []
+        if block_ids is not None:
+            where.append("b.id IN %s")
+            params.append(tuple(block_ids))
+        if line_ids is not None:
+            where.append("b.type = 'hours' AND al.id IN %s")
+            params.append(tuple(line_ids))
+        cr.execute("SELECT b.id, "
+                   "       sum(al.unit_amount / "
+                   "           coalesce(nullif(uom.factor, 0.0), 1.0) * "
+                   "           (1.0 - coalesce(f.factor, 0.0) / 100)) "
+                   "FROM account_hours_block AS b "
+                   "JOIN account_analytic_line AS al "
+                   "     ON al.invoice_id = b.invoice_id "
+                   "JOIN account_analytic_journal AS aj "
+                   "     ON aj.id = al.journal_id AND aj.type = 'general' "
+                   "LEFT JOIN product_uom AS uom "
+                   "     ON uom.id = al.product_uom_id "
+                   "LEFT JOIN " + self._get_invoicing_factor_table(cr, uid) +
+                   "     AS f ON f.id = al.to_invoice "
+                   "WHERE " + " AND ".join(where) + " "
+                   "GROUP BY b.id", params)
+        return dict((block_id, hours or 0.0)
+                    for block_id, hours in cr.fetchall())
+
+    def _apply_hours_used_delta(self, cr, uid, deltas, context=None):
+        """
+        Adjust the stored hours used of blocks by a difference, instead of
+        recomputing them. ``deltas`` is a dict {block_id: hours}
+        """
+        deltas = dict((k, v) for k, v in deltas.items() if v)
+        if not deltas:
+            return True
+        rows = ','.join(cr.mogrify("(%s, %s)", item)
+                        for item in deltas.items())
+        cr.execute("UPDATE account_hours_block AS b SET "
+                   "  amount_hours_block_done = "
+                   "    coalesce(b.amount_hours_block_done, 0.0) + d.delta, "
+                   "  amount_hours_block_delta = "
+                   "    coalesce(b.amount_hours_block_delta, 0.0) - d.delta "
+                   "FROM (VALUES " + rows + ") AS d(id, delta) "
+                   "WHERE b.id = d.id")
+        self.invalidate_cache(
+            cr, uid, ['amount_hours_block_done', 'amount_hours_block_delta'],
+            list(deltas), context=context)
+        return True
+
     def _compute_hours(self, cr, uid, ids, fields, args, context=None):
         """Return a dict of [id][fields]"""
         if isinstance(ids, (int, long)):
             ids = [ids]
         result = {}
-        aal_obj = self.pool.get('account.analytic.line')
-        for block in self.browse(cr, uid, ids, context=context):
-            result[block.id] = {'amount_hours_block': 0.0,
+        if not ids:
+            return result
+        bought = self._get_bought(cr, uid, ids, 'hours', context=context)
+        for block_id in ids:
+            result[block_id] = {'amount_hours_block': bought[block_id],
                                 'amount_hours_block_done': 0.0}
-            # Compute hours bought
-            for line in block.invoice_id.invoice_line:
-                hours_bought = 0.0
-                if line.product_id and line.product_id.is_in_hours_block:
-                    # We will now calculate the product_quantity
-                    factor = line.uos_id.factor
-                    if factor == 0.0:
-                        factor = 1.0
-                    amount = line.quantity
-                    hours_bought += (amount / factor)
-                result[block.id]['amount_hours_block'] += hours_bought
-
-            # Compute hours spent
-            hours_used = 0.0
-            # Get ids of analytic line generated from
-            # timesheet associated to the current block
-            cr.execute("SELECT al.id "
-                       "FROM account_analytic_line AS al, "
-                       "     account_analytic_journal AS aj "
-                       "WHERE aj.id = al.journal_id "
-                       "AND aj.type = 'general' "
-                       "AND al.invoice_id = %s", (block.invoice_id.id,))
-            res_line_ids = cr.fetchall()
-            line_ids = [l[0] for l in res_line_ids] if res_line_ids else []
-            for line in aal_obj.browse(cr, uid, line_ids, context=context):
-                factor = 1.0
-                if line.product_uom_id and line.product_uom_id.factor != 0.0:
-                    factor = line.product_uom_id.factor
-                factor_invoicing = 1.0
-                if line.to_invoice and line.to_invoice.factor != 0.0:
-                    factor_invoicing = 1.0 - line.to_invoice.factor / 100
-                hours_used += ((line.unit_amount / factor) * factor_invoicing)
-            result[block.id]['amount_hours_block_done'] = hours_used
+
+        # Compute hours spent
+        used = self._get_hours_used(cr, uid, block_ids=ids, context=context)
+        for block_id, hours_used in used.items():
+            result[block_id]['amount_hours_block_done'] = hours_used
         return result
 
     def _compute_amount(self, cr, uid, ids, fields, args, context=None):
         if context is None:
             context = {}
+        if isinstance(ids, (int, long)):
+            ids = [ids]
         result = {}
-        aal_obj = self.pool.get('account.analytic.line')
+        if not ids:
+            return result
         pricelist_obj = self.pool.get('product.pricelist')
-        for block in self.browse(cr, uid, ids, context=context):
-            result[block.id] = {'amount_hours_block': 0.0,
+        bought = self._get_bought(cr, uid, ids, 'amount', context=context)
+        for block_id in ids:
+            result[block_id] = {'amount_hours_block': bought[block_id],
                                 'amount_hours_block_done': 0.0}
 
-            # Compute amount bought
-            for line in block.invoice_id.invoice_line:
-                amount_bought = 0.0
-                if line.product_id:
-                    ## We will now calculate the product_quantity
-                    factor = line.uos_id.factor
-                    if factor == 0.0:
-                        factor = 1.0
-                    amount = line.quantity * line.price_unit
-                    amount_bought += (amount / factor)
-                result[block.id]['amount_hours_block'] += amount_bought
-
-            # Compute total amount
-            # Get ids of analytic line generated from timesheet associated to current block
-            cr.execute("SELECT al.id FROM account_analytic_line AS al,"
-                       " account_analytic_journal AS aj"
-                       " WHERE aj.id = al.journal_id"
-                       "  AND aj.type='general'"
-                       "  AND al.invoice_id = %s", (block.invoice_id.id,))
-            res_line_ids = cr.fetchall()
-            line_ids = [l[0] for l in res_line_ids] if res_line_ids else []
-            total_amount = 0.0
-            for line in aal_obj.browse(cr, uid, line_ids, context=context):
-                factor_invoicing = 1.0
-                if line.to_invoice and line.to_invoice.factor != 0.0:
-                    factor_invoicing = 1.0 - line.to_invoice.factor / 100
-
-                ctx = dict(context, uom=line.product_uom_id.id)
-                amount = pricelist_obj.price_get(
-                        cr, uid,
-                        [line.account_id.pricelist_id.id],
-                        line.product_id.id,
-                        line.unit_amount or 1.0,
-                        line.account_id.partner_id.id or False,
-                        ctx)[line.account_id.pricelist_id.id]
-                total_amount += amount * line.unit_amount * factor_invoicing
-            result[block.id]['amount_hours_block_done'] += total_amount
-
+        # Compute total amount, from the analytic lines generated from
+        # timesheet associated to the blocks invoices, fetched at once.
+        # Identical lines are grouped, and prices memoized, so that the
+        # pricelist is only evaluated once per distinct price request.
+        cr.execute("SELECT b.id, a.pricelist_id, al.product_id, "
+                   "       al.unit_amount, a.partner_id, "
+                   "       al.product_uom_id, "
+                   "       1.0 - coalesce(f.factor, 0.0) / 100, "
+                   "       count(*) "
+                   "FROM account_hours_block AS b "
+                   "JOIN account_analytic_line AS al "
+                   "     ON al.invoice_id = b.invoice_id "
+                   "JOIN account_analytic_journal AS aj "
+                   "     ON aj.id = al.journal_id AND aj.type = 'general' "
+                   "JOIN account_analytic_account AS a "
+                   "     ON a.id = al.account_id "
+                   "LEFT JOIN " + self._get_invoicing_factor_table(cr, uid) +
+                   "     AS f ON f.id = al.to_invoice "
+                   "WHERE b.id IN %s "
+                   "GROUP BY b.id, a.pricelist_id, al.product_id, "
+                   "         al.unit_amount, a.partner_id, "
+                   "         al.product_uom_id, f.factor", (tuple(ids),))
+        prices = {}
+        for (block_id, pricelist_id, product_id, unit_amount, partner_id,
+                uom_id, factor_invoicing, count) in cr.fetchall():
+            qty = unit_amount or 1.0
+            key = (pricelist_id, product_id, qty, partner_id, uom_id,
+                   context.get('date'))
+            if key not in prices:
+                ctx = dict(context, uom=uom_id)
+                prices[key] = pricelist_obj.price_get(
+                    cr, uid,
+                    [pricelist_id],
+                    product_id,
+                    qty,
+                    partner_id or False,
+                    ctx)[pricelist_id]
+            result[block_id]['amount_hours_block_done'] += \
+                prices[key] * unit_amount * factor_invoicing * count
         return result
 
+    def _get_ids_per_type(self, cr, uid, ids, context=None):
+        """ Return the block ids grouped by block type, as a dict """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        res = {}
+        if not ids:
+            return res
+        cr.execute("SELECT id, type FROM account_hours_block "
+                   "WHERE id IN %s", (tuple(ids),))
+        for block_id, block_type in cr.fetchall():
+            res.setdefault(block_type, []).append(block_id)
+        return res
+
     def _compute(self, cr, uid, ids, fields, args, context=None):
+        """
+        Compute each block with the ``_compute_<type>`` method of its type,
+        only once: each method is called with the blocks of its type only.
+        """
         result = {}
-        block_per_types = {}
-        for block in self.browse(cr, uid, ids, context=context):
-            block_per_types.setdefault(block.type, []).append(block.id)
-
-        for block_type in block_per_types:
+        block_per_types = self._get_ids_per_type(
+            cr, uid, ids, context=context)
+        for block_type, type_ids in block_per_types.items():
             if block_type:
                 func = getattr(self, "_compute_%s" % block_type)
-                result.update(func(cr, uid, ids, fields, args, context=context))
+                result.update(
+                    func(cr, uid, type_ids, fields, args, context=context))
 
         for block in result:
             result[block]['amount_hours_block_delta'] = \
@@ -148,14 +240,21 @@ class AccountHoursBlock(orm.Model):
         return result
 
     def _get_analytic_line(self, cr, uid, ids, context=None):
-        invoice_ids = []
-        an_lines_obj = self.pool.get('account.analytic.line')
-        block_obj = self.pool.get('account.hours.block')
-        for line in an_lines_obj.browse(cr, uid, ids, context=context):
-            if line.invoice_id:
-                invoice_ids.append(line.invoice_id.id)
-        return block_obj.search(
-                cr, uid, [('invoice_id', 'in', invoice_ids)], context=context)
+        """
+        Return the blocks of the invoices of analytic lines, with a single
+        query. Hours blocks updated by difference, when only the lines
+        quantities change, are left out (see ``AccountAnalyticLine.write``):
+        the ``hours_block_delta`` context key holds the ids of those lines.
+        """
+        query = ("SELECT DISTINCT b.id FROM account_hours_block AS b "
+                 "JOIN account_analytic_line AS al "
+                 "     ON al.invoice_id = b.invoice_id "
+                 "WHERE al.id IN %s")
+        delta_ids = (context or {}).get('hours_block_delta') or ()
+        if delta_ids and set(ids) <= set(delta_ids):
+            query += " AND b.type != 'hours'"
+        cr.execute(query, (tuple(ids),))
+        return [row[0] for row in cr.fetchall()]
 
     def _get_invoice(self, cr, uid, ids, context=None):
         block_ids = set()
@@ -246,6 +345,12 @@ class AccountHoursBlock(orm.Model):
             _get_last_action,
             type='date',
             string='Last action date',
+            store={
+                'account.hours.block': (lambda self, cr, uid, ids, c=None: ids,
+                                        ['invoice_id'], 10),
+                'account.analytic.line': (_get_analytic_line,
+                                          ['date', 'invoice_id'], 10),
+            },
             help="Date of the last analytic line linked to the invoice "
                  "related to this block hours."),
         'close_date': fields.date('Closed Date'),
@@ -253,7 +358,8 @@ class AccountHoursBlock(orm.Model):
             'account.invoice',
             'Invoice',
             ondelete='cascade',
-            required=True),
+            required=True,
+            select=True),
         'type': fields.selection(
             [('hours', 'Hours'),
              ('amount', 'Amount')],
@@ -424,3 +530,50 @@ class AccountInvoice(orm.Model):
             'invoice_id',
             string='Hours Block')
     }
+
+
+############################################################################
+## Update hours blocks on analytic lines quantity changes
+############################################################################
+class AccountAnalyticLine(orm.Model):
+    _inherit = 'account.analytic.line'
+
+    def _auto_init(self, cr, context=None):
+        res = super(AccountAnalyticLine, self)._auto_init(cr, context=context)
+        # Used to find the last action date of hours blocks
+        index = 'account_analytic_line_invoice_id_date_index'
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s",
+                   (index,))
+        if not cr.fetchone():
+            cr.execute("CREATE INDEX %s ON account_analytic_line "
+                       "(invoice_id, date)" % index)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        """
+        When only the quantity of lines changes, the hours used of their
+        hours blocks are adjusted by the difference instead of being
+        recomputed from all the lines of the blocks invoices.
+
+        Only the store triggers of this very write leave those hours
+        blocks out: nested writes get the context without the flag.
+        """
+        context = dict(context or {})
+        context.pop('hours_block_delta', None)
+        if set(vals) != set(['unit_amount']):
+            return super(AccountAnalyticLine, self).write(
+                cr, uid, ids, vals, context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        block_obj = self.pool.get('account.hours.block')
+        before = block_obj._get_hours_used(
+            cr, uid, line_ids=ids, context=context)
+        ctx = dict(context, hours_block_delta=tuple(ids))
+        res = super(AccountAnalyticLine, self).write(
+            cr, uid, ids, vals, context=ctx)
+        after = block_obj._get_hours_used(
+            cr, uid, line_ids=ids, context=context)
+        deltas = dict((block_id, hours - before.get(block_id, 0.0))
+                      for block_id, hours in after.items())
+        block_obj._apply_hours_used_delta(cr, uid, deltas, context=context)
+        return res
@@ -7,13 +7,13 @@ class project_project(orm.Model):
     _inherit = 'project.project'
 
     def hours_block_tree_view(self, cr, uid, ids, context):
-        invoice_line_obj = self.pool.get('account.invoice.line')
         hours_block_obj = self.pool.get('account.hours.block')
         project = self.browse(cr, uid , ids)[0]
-        invoice_line_ids = invoice_line_obj.search(cr, uid, [('account_analytic_id', '=', project.analytic_account_id.id)])
-        invoice_lines =  invoice_line_obj.browse(cr, uid, invoice_line_ids)
-        invoice_ids = [x.invoice_id.id for x in invoice_lines]
-        res_ids = hours_block_obj.search(cr, uid, [('invoice_id','in',invoice_ids)])
+        # Blocks whose invoice has lines on the project analytic account,
+        # found with a single search joining the invoice lines
+        res_ids = hours_block_obj.search(cr, uid, [
+            ('invoice_id.invoice_line.account_analytic_id', '=',
+             project.analytic_account_id.id)])
         domain=False
         if res_ids:
             domain = [('id', 'in', res_ids)]
@@ -23,8 +23,38 @@ import time
 from openerp.report import report_sxw
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT
 
+# Number of analytic lines read at once when printing the detailed report
+REPORT_PAGE_SIZE = 1000
+
+
+class InvoicingFactor(object):
+    """ Invoicing factor of a report line, false when the line has none """
+
+    def __init__(self, factor_id, customer_name, factor):
+        self.id = factor_id
+        self.customer_name = customer_name or ''
+        self.factor = factor or 0.0
+
+    def __nonzero__(self):
+        return bool(self.id)
+    __bool__ = __nonzero__
+
+
+class ReportLine(object):
+    """ Analytic line, or group of lines, printed on the report """
+
+    def __init__(self, date, name, unit_amount, to_invoice):
+        self.date = date
+        self.name = name
+        self.unit_amount = unit_amount or 0.0
+        self.to_invoice = to_invoice
+
 
 class account_hours_block(report_sxw.rml_parse):
+    # Aggregate the timesheet lines per 'day' or per 'user', or print
+    # them all when not set
+    group_by = None
+
     def __init__(self, cr, uid, name, context=None):
         super(account_hours_block, self).__init__(cr, uid, name, context=context)
         self.localcontext.update({'time': time,
@@ -34,20 +64,90 @@ class account_hours_block(report_sxw.rml_parse):
         self.context = context
 
     def _get_analytic_lines(self, hours_block):
+        """
+        Return the timesheet lines of the block invoice, most recent first.
+        Lines are read page by page, with their invoicing factor, and
+        returned as plain objects instead of browse records, so that the
+        report doesn't keep every line and its related records in cache.
+        """
+        if self.group_by:
+            return self._get_grouped_analytic_lines(hours_block)
+        return self._iter_analytic_lines(hours_block)
+
+    def _get_factor_table(self):
         al_pool = self.pool.get('account.analytic.line')
-        aj_pool = self.pool.get('account.analytic.journal')
-        tcj_ids = aj_pool.search(self.cr, self.uid,
-                                 [('type', '=', 'general')])
-        al_ids = al_pool.search(self.cr,
-                                self.uid,
-                                [('invoice_id', '=', hours_block.invoice_id.id),
-                                 ('journal_id', 'in', tcj_ids),
-                                 ],
-                                order='date desc',
-                                context=self.context)
-        return al_pool.browse(self.cr, self.uid, al_ids, context=self.context)
+        return self.pool[al_pool._columns['to_invoice']._obj]._table
+
+    def _iter_analytic_lines(self, hours_block):
+        query = ("SELECT al.id, al.date, al.name, al.unit_amount, "
+                 "       f.id, f.customer_name, f.factor "
+                 "FROM account_analytic_line AS al "
+                 "JOIN account_analytic_journal AS aj "
+                 "     ON aj.id = al.journal_id AND aj.type = 'general' "
+                 "LEFT JOIN " + self._get_factor_table() + " AS f "
+                 "     ON f.id = al.to_invoice "
+                 "WHERE al.invoice_id = %s ")
+        last = None
+        while True:
+            params = [hours_block.invoice_id.id]
+            where = ""
+            if last:
+                where = "AND (al.date, al.id) < (%s, %s) "
+                params.extend(last)
+            self.cr.execute(query + where +
+                            "ORDER BY al.date DESC, al.id DESC LIMIT %s",
+                            params + [REPORT_PAGE_SIZE])
+            rows = self.cr.fetchall()
+            for (line_id, date, name, unit_amount,
+                    factor_id, customer_name, factor) in rows:
+                yield ReportLine(date, name, unit_amount, InvoicingFactor(
+                    factor_id, customer_name, factor))
+            if len(rows) < REPORT_PAGE_SIZE:
+                break
+            last = (rows[-1][1], rows[-1][0])
+
+    def _get_grouped_analytic_lines(self, hours_block):
+        if self.group_by == 'user':
+            date, name = "max(al.date)", "p.name"
+            join = ("LEFT JOIN res_users AS u ON u.id = al.user_id "
+                    "LEFT JOIN res_partner AS p ON p.id = u.partner_id ")
+            group_by = "al.user_id, p.name"
+        else:
+            date, name, join, group_by = "al.date", "''", "", "al.date"
+        self.cr.execute(
+            "SELECT " + date + ", " + name + ", sum(al.unit_amount), "
+            "       f.id, f.customer_name, f.factor "
+            "FROM account_analytic_line AS al "
+            "JOIN account_analytic_journal AS aj "
+            "     ON aj.id = al.journal_id AND aj.type = 'general' "
+            "LEFT JOIN " + self._get_factor_table() + " AS f "
+            "     ON f.id = al.to_invoice " + join +
+            "WHERE al.invoice_id = %s "
+            "GROUP BY " + group_by + ", f.id, f.customer_name, f.factor "
+            "ORDER BY 1 DESC, 2", (hours_block.invoice_id.id,))
+        return [ReportLine(date, name, unit_amount, InvoicingFactor(
+                    factor_id, customer_name, factor))
+                for date, name, unit_amount, factor_id, customer_name, factor
+                in self.cr.fetchall()]
+
+
+class account_hours_block_day(account_hours_block):
+    group_by = 'day'
+
+
+class account_hours_block_user(account_hours_block):
+    group_by = 'user'
+
 
 report_sxw.report_sxw('report.account.hours.block',
                       'account.hours.block',
                       'addons/analytic_hours_block/report/hours_block.rml',
                       parser=account_hours_block)
+report_sxw.report_sxw('report.account.hours.block.day',
+                      'account.hours.block',
+                      'addons/analytic_hours_block/report/hours_block.rml',
+                      parser=account_hours_block_day)
+report_sxw.report_sxw('report.account.hours.block.user',
+                      'account.hours.block',
+                      'addons/analytic_hours_block/report/hours_block.rml',
+                      parser=account_hours_block_user)
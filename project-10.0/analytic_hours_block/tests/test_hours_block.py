@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from openerp.tests.common import TransactionCase
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class TestHoursBlock(TransactionCase):
+    """ Test the computation of hours and amount blocks
+    """
+
+    def setUp(self):
+        super(TestHoursBlock, self).setUp()
+        cr, uid = self.cr, self.uid
+        self.block_obj = self.registry['account.hours.block']
+        self.product_id = self.ref('product.product_product_consultant')
+        self.registry['product.product'].write(
+            cr, uid, [self.product_id], {'is_in_hours_block': True})
+        self.account_id = self.registry['account.analytic.account'].create(
+            cr, uid, {'name': 'Hours block test',
+                      'pricelist_id': self.ref('product.list0')})
+        self.journal_id = self.registry['account.analytic.journal'].create(
+            cr, uid, {'name': 'Hours block timesheets', 'type': 'general'})
+
+    def create_block(self, block_type, quantity, price, hours):
+        """ Create a block, its invoice and a timesheet line on it """
+        cr, uid = self.cr, self.uid
+        invoice_id = self.registry['account.invoice'].create(cr, uid, {
+            'partner_id': self.ref('base.res_partner_2'),
+            'account_id': self.ref('account.a_recv'),
+            'invoice_line': [(0, 0, {
+                'name': 'Hours block',
+                'product_id': self.product_id,
+                'quantity': quantity,
+                'price_unit': price,
+                'account_id': self.ref('account.a_sale'),
+            })],
+        })
+        self.line_id = self.registry['account.analytic.line'].create(cr, uid, {
+            'name': 'Timesheet',
+            'account_id': self.account_id,
+            'journal_id': self.journal_id,
+            'general_account_id': self.ref('account.a_expense'),
+            'product_id': self.product_id,
+            'unit_amount': hours,
+            'amount': 0.0,
+            'invoice_id': invoice_id,
+        })
+        return self.block_obj.create(cr, uid, {
+            'invoice_id': invoice_id,
+            'type': block_type,
+        })
+
+    def test_10_compute_per_type(self):
+        cr, uid = self.cr, self.uid
+        hours_id = self.create_block('hours', 10.0, 50.0, 4.0)
+        amount_id = self.create_block('amount', 10.0, 50.0, 4.0)
+        fields = ['amount_hours_block', 'amount_hours_block_done',
+                  'amount_hours_block_delta']
+        res = self.block_obj._compute(
+            cr, uid, [hours_id, amount_id], fields, None)
+        self.assertEqual(res[hours_id]['amount_hours_block'], 10.0)
+        self.assertEqual(res[hours_id]['amount_hours_block_done'], 4.0)
+        self.assertEqual(res[hours_id]['amount_hours_block_delta'], 6.0)
+        self.assertEqual(res[amount_id]['amount_hours_block'], 500.0)
+        # Each block is computed by the calculator of its type only
+        expected = self.block_obj._compute_amount(
+            cr, uid, [amount_id], fields, None)
+        self.assertEqual(res[amount_id]['amount_hours_block_done'],
+                         expected[amount_id]['amount_hours_block_done'])
+
+    def test_20_compute_benchmark(self):
+        """ Benchmark computing mixed blocks once per type """
+        cr, uid = self.cr, self.uid
+        count = 20
+        ids = [self.create_block(block_type, 10.0, 50.0, 1.0 + i % 4)
+               for i in range(count)
+               for block_type in ('hours', 'amount')]
+        fields = ['amount_hours_block']
+
+        def timed(function):
+            queries = cr.sql_log_count
+            start = time.time()
+            function()
+            return time.time() - start, cr.sql_log_count - queries
+
+        def all_types():
+            # previous dispatch: every calculator on every block
+            self.block_obj._compute_hours(cr, uid, ids, fields, None)
+            self.block_obj._compute_amount(cr, uid, ids, fields, None)
+
+        before, before_queries = timed(all_types)
+        after, after_queries = timed(
+            lambda: self.block_obj._compute(cr, uid, ids, fields, None))
+        _logger.info(
+            'Mixed hours blocks compute: %.2fms and %d queries, instead of '
+            '%.2fms and %d queries', after * 1000, after_queries,
+            before * 1000, before_queries)
+        self.assertLessEqual(after_queries, before_queries)
+
+    def test_30_unit_amount_delta(self):
+        """ Changing a line quantity adjusts the hours used by difference """
+        cr, uid = self.cr, self.uid
+        block_id = self.create_block('hours', 10.0, 50.0, 4.0)
+        self.registry['account.analytic.line'].write(
+            cr, uid, [self.line_id], {'unit_amount': 7.0})
+        block = self.block_obj.browse(cr, uid, block_id)
+        self.assertEqual(block.amount_hours_block_done, 7.0)
+        self.assertEqual(block.amount_hours_block_delta, 3.0)
+
+    def test_35_unit_amount_then_invoice(self):
+        """ A line moved to another invoice after a quantity change is
+        counted in the new block only, also from a nested write """
+        cr, uid = self.cr, self.uid
+        line_obj = self.registry['account.analytic.line']
+        block_id = self.create_block('hours', 10.0, 50.0, 4.0)
+        line_id = self.line_id
+        line_obj.write(cr, uid, [line_id], {'unit_amount': 7.0})
+        other_id = self.create_block('hours', 10.0, 50.0, 2.0)
+        other = self.block_obj.browse(cr, uid, other_id)
+        # as a write nested in the quantity change one would get it
+        line_obj.write(cr, uid, [line_id],
+                       {'invoice_id': other.invoice_id.id},
+                       context={'hours_block_delta': (line_id,)})
+        self.block_obj.invalidate_cache(cr, uid)
+        block = self.block_obj.browse(cr, uid, block_id)
+        other = self.block_obj.browse(cr, uid, other_id)
+        self.assertEqual(block.amount_hours_block_done, 0.0)
+        self.assertEqual(other.amount_hours_block_done, 9.0)
+        self.assertEqual(other.amount_hours_block_delta, 1.0)
+
+    def test_40_last_action_date(self):
+        cr, uid = self.cr, self.uid
+        block_id = self.create_block('hours', 10.0, 50.0, 4.0)
+        line_obj = self.registry['account.analytic.line']
+        line_obj.write(cr, uid, [self.line_id], {'date': '2015-04-09'})
+        block = self.block_obj.browse(cr, uid, block_id)
+        self.assertEqual(block.last_action_date, '2015-04-09')
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# See README.rst file on addon root folder for license details
+
+from datetime import datetime, timedelta
+
+# Same limit as resource.calendar schedule_days, to avoid infinite loops
+MAX_ITERATIONS = 1000
+
+# Working intervals cache lookups and misses, in this process
+cache_counters = {'lookups': 0, 'misses': 0}
+
+
+def cache_stats():
+    """ Printable summary of the working intervals cache usage """
+    lookups = cache_counters['lookups']
+    misses = cache_counters['misses']
+    ratio = lookups and 100.0 * (lookups - misses) / lookups or 0.0
+    return '%d hits, %d misses (%.1f%%)' % (lookups - misses, misses, ratio)
+
+
+class CalendarDays(object):
+    """
+        Working days of a calendar and resource, used to schedule many
+        tasks at once: the working intervals of each day are asked to
+        resource.calendar only once, and kept in a day map that the
+        scheduling methods walk through.
+
+        Days are always looked at as a whole, as schedule_days does when
+        moving from a day to the next or previous one.
+
+        The working intervals of days are also cached by
+        resource.calendar, for all the recalculations, along with the
+        signature of the calendar read the first time a day is asked.
+    """
+
+    def __init__(self, env, calendar=None, resource=None,
+                 default_interval=None):
+        self.env = env
+        self.calendar_id = calendar.id if calendar else None
+        self.resource_id = resource.id if resource else None
+        self.default_interval = default_interval
+        self.weekdays = set()
+        if self.calendar_id:
+            self.weekdays = set(env.registry['resource.calendar'].get_weekdays(
+                env.cr, env.uid, self.calendar_id, context=env.context))
+        self._days = {}
+        self._signature = None
+
+    def intervals(self, day):
+        """ Working intervals of a date, or of the date of a datetime """
+        if isinstance(day, datetime):
+            day = day.date()
+        if day not in self._days:
+            rc = self.env.registry['resource.calendar']
+            if self._signature is None:
+                self._signature = rc._get_cache_signature(
+                    self.env.cr, self.env.uid, self.calendar_id)
+            tz = self.env.context.get('tz') or self.env.user.tz or False
+            self._days[day] = rc._day_intervals_get(
+                self.env.cr, self.env.uid, self.calendar_id,
+                self.resource_id, day, tz, self.default_interval,
+                self._signature)
+        return self._days[day]
+
+    def first_interval(self, day):
+        intervals = self.intervals(day)
+        return intervals and intervals[0] or False
+
+    def is_working(self, day):
+        """ Whether schedule counts the date as a working day """
+        if isinstance(day, datetime):
+            day = day.date()
+        if self.weekdays and day.weekday() not in self.weekdays:
+            return False
+        return self.calendar_id is None or bool(self.intervals(day))
+
+    def adjacent(self, day_date, step=1):
+        """
+            Working intervals of the nearest working day after the date of
+            ``day_date``, or before it if ``step`` is negative
+        """
+        step = timedelta(days=-1 if step < 0 else 1)
+        day = day_date.date()
+        for i in range(MAX_ITERATIONS):
+            day += step
+            if self.is_working(day):
+                return self.intervals(day)
+        return ()
+
+    def count(self, start, end):
+        """ Number of working days from the date of ``start`` to the date
+            of ``end``, this one excluded """
+        day, end = start.date(), end.date()
+        days = 0
+        while day < end:
+            if self.is_working(day):
+                days += 1
+            day += timedelta(days=1)
+        return days
+
+    def schedule(self, days, day_date):
+        """
+            Same as resource.calendar schedule_days: plan ``days`` working
+            days from ``day_date``, backwards if ``days`` is negative.
+            Returns the first and last working intervals.
+        """
+        if not day_date:
+            return (False, False)
+        step = timedelta(days=-1 if days < 0 else 1)
+        days = abs(days)
+        day = day_date.date()
+        first = last = False
+        planned = iterations = 0
+        while planned < days and iterations < MAX_ITERATIONS:
+            if self.weekdays and day.weekday() not in self.weekdays:
+                # Not a working weekday: skipped by schedule_days too
+                day += step
+                continue
+            intervals = self.intervals(day)
+            if self.calendar_id is None or intervals:
+                planned += 1
+                if intervals:
+                    first = first or intervals[0]
+                    last = intervals[-1]
+            day += step
+            iterations += 1
+        return (first, last)
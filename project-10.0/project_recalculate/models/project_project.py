@@ -15,6 +15,11 @@ class ProjectProject(models.Model):
         string='Calculation type', default=False,
         help='How to calculate tasks, with date start or date end references. '
              'If not set, "Recalculate project" button is disabled.')
+    use_task_dependencies = fields.Boolean(
+        string='Use task dependencies',
+        help='Tasks start after the end of the tasks they depend on, and '
+             'their slack days and critical path are computed. '
+             'Dependencies are defined with Project Task Dependency addon.')
 
     def _start_end_dates_prepare(self):
         """
@@ -65,8 +70,10 @@ class ProjectProject(models.Model):
                 raise Warning(_("Cannot recalculate project because your "
                                 "project don't have date end."))
             if project.calculation_type != 'none':
-                for task in project.tasks:
-                    task.task_recalculate()
+                if project.use_task_dependencies:
+                    project.tasks.task_recalculate_critical_path()
+                else:
+                    project.tasks.task_recalculate()
                 vals = project._start_end_dates_prepare()
                 if vals:
                     project.write(vals)
@@ -3,7 +3,15 @@
 
 from openerp import models, fields, api, _
 from openerp.exceptions import Warning, ValidationError
+from collections import deque
 from datetime import datetime
+from .calendar_days import CalendarDays, cache_stats
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Default working interval, converted to each timezone, for the current day
+_default_intervals = {}
 
 
 class ProjectTask(models.Model):
@@ -17,6 +25,19 @@ class ProjectTask(models.Model):
         oldname='anticipation_days')
     include_in_recalculate = fields.Boolean(
         related="stage_id.include_in_recalculate")
+    date_earliest_start = fields.Datetime(
+        string='Earliest start', readonly=True, copy=False,
+        help='Earliest start date allowed by the task dependencies')
+    date_latest_start = fields.Datetime(
+        string='Latest start', readonly=True, copy=False,
+        help='Latest start date not delaying the project')
+    slack_days = fields.Integer(
+        string='Slack days', readonly=True, copy=False,
+        help='Working days this task can be delayed without delaying '
+             'the project')
+    critical_path = fields.Boolean(
+        string='Critical path', readonly=True, copy=False,
+        help='This task can not be delayed without delaying the project')
 
     @api.one
     @api.constrains('estimated_days')
@@ -24,7 +45,46 @@ class ProjectTask(models.Model):
         if not self.estimated_days > 0:
             raise ValidationError(_('Estimated days must be greater than 0.'))
 
-    def _dates_onchange(self, vals):
+    def _dates_changed(self, vals):
+        """
+            Whether estimated_days and from_days must be calculated again
+            from the dates written in vals
+        """
+        # If no date changes, do nothing
+        if 'date_start' not in vals and 'date_end' not in vals:
+            return False
+        # If we are changing dates because of task recalculating, do nothing
+        return not self.env.context.get('task_recalculate')
+
+    def _calendar_get(self, memo=None):
+        """
+            Resource, working calendar and its working days of this task,
+            kept in ``memo`` for the tasks with the same user and project
+        """
+        memo = {} if memo is None else memo
+        key = (self.user_id.id, self.project_id.id)
+        if key not in memo:
+            resource, calendar = self._resource_calendar_select()
+            memo[key] = (resource, calendar, CalendarDays(
+                self.env, calendar, resource, self._interval_default_get()))
+        return memo[key]
+
+    def _working_days_get(self, start, end, resource=None, calendar=None,
+                          memo=None):
+        memo = {} if memo is None else memo
+        calendar_id = calendar.id if calendar else None
+        resource_id = resource.id if resource else None
+        key = (calendar_id, resource_id, start, end)
+        if key not in memo:
+            rc = self.pool['resource.calendar']
+            memo[key] = rc.get_working_days_of_date(
+                self.env.cr, self.env.uid, calendar_id, start_dt=start,
+                end_dt=end, compute_leaves=True, resource_id=resource_id,
+                default_interval=self._interval_default_get(),
+                context=self.env.context)
+        return memo[key]
+
+    def _dates_onchange(self, vals, memo=None):
         """
             Try to calculate estimated_days and from_days fields
             when date_start or date_end change.
@@ -33,14 +93,14 @@ class ProjectTask(models.Model):
             estimated_days and from_days
             except if context['task_recalculate'] == True, in other words,
             except if this change is done because task recalculating.
+
+            ``memo`` keeps calendars and working days between the tasks
+            of a same write.
         """
         self.ensure_one()
-        # If no date changes, do nothing
-        if 'date_start' not in vals and 'date_end' not in vals:
-            return vals
-        # If we are changing dates because of task recalculating, do nothing
-        if self.env.context.get('task_recalculate'):
+        if not self._dates_changed(vals):
             return vals
+        memo = {} if memo is None else memo
         date_start = vals.get('date_start', self.date_start)
         date_end = vals.get('date_end', self.date_end)
         # If any date is False, can't calculate estimated_days nor from_days
@@ -52,16 +112,12 @@ class ProjectTask(models.Model):
         # If end < start, do nothing
         if end < start:
             return vals
-        rc = self.pool['resource.calendar']
-        resource, calendar = self._resource_calendar_select()
-        default_interval = self._interval_default_get()
-        calendar_id = calendar.id if calendar else None
-        resource_id = resource.id if resource else None
+        resource, calendar, calendar_days = self._calendar_get(
+            memo.setdefault('calendars', {}))
+        working_days = memo.setdefault('working_days', {})
         # Calculate estimated_day
-        vals['estimated_days'] = rc.get_working_days_of_date(
-            self.env.cr, self.env.uid, calendar_id, start_dt=start,
-            end_dt=end, compute_leaves=True, resource_id=resource_id,
-            default_interval=default_interval, context=self.env.context)
+        vals['estimated_days'] = self._working_days_get(
+            start, end, resource, calendar, working_days)
         # Calculate from_days depending on project calculation type
         calculation_type = self.project_id.calculation_type
         if calculation_type:
@@ -82,14 +138,13 @@ class ProjectTask(models.Model):
             if end < start:
                 invert = True
                 start, end = end, start
-            from_days = rc.get_working_days_of_date(
-                self.env.cr, self.env.uid, calendar_id, start_dt=start,
-                end_dt=end, compute_leaves=True, resource_id=resource_id,
-                default_interval=default_interval, context=self.env.context)
+            from_days = self._working_days_get(
+                start, end, resource, calendar, working_days)
             if invert and from_days:
                 from_days = from_days * (-1)
             from_days = self._from_days_enc(
-                from_days, project_date, resource, calendar, increment)
+                from_days, project_date, resource, calendar, increment,
+                calendar_days=calendar_days)
             vals['from_days'] = from_days
         return vals
 
@@ -134,9 +189,11 @@ class ProjectTask(models.Model):
         return resource, calendar
 
     def _from_days_enc(self, from_days, project_date,
-                       resource=None, calendar=None, increment=True):
+                       resource=None, calendar=None, increment=True,
+                       calendar_days=None):
         interval = self._first_interval_of_day_get(
-            project_date, resource=resource, calendar=calendar)
+            project_date, resource=resource, calendar=calendar,
+            calendar_days=calendar_days)
         # If project_date is holidays
         if not interval:
             if from_days > 0 and increment:
@@ -148,11 +205,13 @@ class ProjectTask(models.Model):
         return from_days
 
     def _from_days_dec(self, from_days, project_date,
-                       resource=None, calendar=None, increment=True):
+                       resource=None, calendar=None, increment=True,
+                       calendar_days=None):
         if from_days == 0:
             return 1 if increment else -1
         interval = self._first_interval_of_day_get(
-            project_date, resource=resource, calendar=calendar)
+            project_date, resource=resource, calendar=calendar,
+            calendar_days=calendar_days)
         # If project_date is not holidays
         if interval:
             if from_days > 0:
@@ -192,72 +251,333 @@ class ProjectTask(models.Model):
 
     def _interval_default_get(self):
         default = (8, 18)
-        return self._interval_context_tz(default)
+        # The conversion only changes with the timezone offset of the day
+        tz = self.env.context.get('tz') or self.env.user.tz
+        today = datetime.now().date()
+        cached = _default_intervals.get(tz)
+        if not cached or cached[0] != today:
+            cached = (today, self._interval_context_tz(default))
+            _default_intervals[tz] = cached
+        return cached[1]
 
     def _first_interval_of_day_get(self, day_date, resource=None,
-                                   calendar=None):
-        calendar_id = calendar.id if calendar else None
-        resource_id = resource.id if resource else None
-        default_interval = self._interval_default_get()
-        rc = self.pool['resource.calendar']
-        intervals = rc.get_working_intervals_of_day(
-            self.env.cr, self.env.uid, calendar_id, start_dt=day_date,
-            compute_leaves=True, resource_id=resource_id,
-            default_interval=default_interval, context=self.env.context)
-        return intervals and intervals[0] or False
+                                   calendar=None, calendar_days=None):
+        if calendar_days is None:
+            calendar_days = CalendarDays(
+                self.env, calendar, resource, self._interval_default_get())
+        return calendar_days.first_interval(day_date)
 
     def _calendar_schedule_days(self, days, day_date,
-                                resource=None, calendar=None):
+                                resource=None, calendar=None,
+                                calendar_days=None):
         if not day_date:
             return (False, False)
-        calendar_id = calendar.id if calendar else None
-        resource_id = resource.id if resource else None
-        default_interval = self._interval_default_get()
-        intervals = self.pool['resource.calendar'].schedule_days(
-            self.env.cr, self.env.uid, calendar_id, days, day_date=day_date,
-            compute_leaves=True, resource_id=resource_id,
-            default_interval=default_interval, context=self.env.context)
-        return (intervals and intervals[0] or False,
-                intervals and intervals[-1] or False)
+        if calendar_days is None:
+            calendar_days = CalendarDays(
+                self.env, calendar, resource, self._interval_default_get())
+        return calendar_days.schedule(days, day_date)
+
+    def _task_dates_get(self, calendar_days):
+        """
+            Start and end dates of this task depending on project
+            calculation_type, estimated_days and from_days
+        """
+        increment, project_date, from_days = self._calculation_prepare()
+        date_start = False
+        date_end = False
+        from_days = self._from_days_dec(
+            from_days, project_date, increment=increment,
+            calendar_days=calendar_days)
+        start = self._calendar_schedule_days(
+            from_days, project_date, calendar_days=calendar_days)[1]
+        if start:
+            first = calendar_days.first_interval(start[0])
+            if first:
+                date_start = first[0]
+        if date_start:
+            end = self._calendar_schedule_days(
+                self.estimated_days, date_start,
+                calendar_days=calendar_days)[1]
+            if end:
+                date_end = end[1]
+        return date_start, date_end
+
+    def _task_dates_write(self, dates):
+        """
+            Write dates, as {task_id: (date_start, date_end)}, writing
+            together the tasks getting the same dates
+        """
+        to_string = fields.Datetime.to_string
+        groups = {}
+        for task_id, task_dates in dates.items():
+            groups.setdefault(task_dates, []).append(task_id)
+        for (date_start, date_end), task_ids in groups.items():
+            tasks = self.browse(task_ids).with_context(
+                self.env.context, task_recalculate=True)
+            tasks.write({
+                'date_start': date_start and to_string(date_start) or False,
+                'date_end': date_end and to_string(date_end) or False,
+                'date_deadline': date_end and to_string(date_end) or False,
+            })
+        return True
 
     @api.multi
     def task_recalculate(self):
         """
             Recalculate task start date and end date depending on
             project calculation_type, estimated_days and from_days
+
+            Calendar and resource are selected once per (user, project),
+            and the working days of each one are computed once for all
+            its tasks. Tasks getting the same dates are written together.
         """
-        to_string = fields.Datetime.to_string
+        calendars = {}
+        dates = {}
         for task in self:
             if not task.include_in_recalculate:
                 continue
-            resource, calendar = task._resource_calendar_select()
-            increment, project_date, from_days = task._calculation_prepare()
-            date_start = False
-            date_end = False
-            from_days = self._from_days_dec(
-                from_days, project_date, resource, calendar, increment)
-            start = self._calendar_schedule_days(
-                from_days, project_date, resource, calendar)[1]
-            if start:
-                day = start[0].replace(hour=0, minute=0, second=0)
-                first = self._first_interval_of_day_get(
-                    day, resource, calendar)
-                if first:
-                    date_start = first[0]
-            if date_start:
-                end = self._calendar_schedule_days(
-                    task.estimated_days, date_start, resource, calendar)[1]
-                if end:
-                    date_end = end[1]
-            task.with_context(task.env.context, task_recalculate=True).write({
-                'date_start': date_start and to_string(date_start) or False,
-                'date_end': date_end and to_string(date_end) or False,
-                'date_deadline': date_end and to_string(date_end) or False,
-            })
+            calendar_days = task._calendar_get(calendars)[2]
+            dates[task.id] = task._task_dates_get(calendar_days)
+        self._task_dates_write(dates)
+        if calendars:
+            _logger.info('%d tasks recalculated, working days cache: %s',
+                         len(self), cache_stats())
         return True
 
-    @api.one
+    def _dependencies_get(self):
+        """
+            Dependencies between these tasks, as {task_id: [task_ids it
+            depends on]}, read with the Project Task Dependency addon
+            relation when it is installed
+        """
+        res = dict((task_id, []) for task_id in self.ids)
+        field = self._fields.get('dependency_task_ids')
+        if not field or not self.ids:
+            return res
+        cr = self.env.cr
+        for sub_ids in cr.split_for_in_conditions(self.ids):
+            cr.execute(
+                'SELECT %s, %s FROM %s WHERE %s IN %%s AND %s IN %%s' % (
+                    field.column1, field.column2, field.relation,
+                    field.column1, field.column2),
+                (sub_ids, tuple(self.ids)))
+            for task_id, dependency_id in cr.fetchall():
+                res[task_id].append(dependency_id)
+        return res
+
+    def _topological_sort(self, dependencies):
+        """
+            Order task ids so that every task comes after the tasks it
+            depends on, given as {task_id: [task_ids it depends on]}.
+            Returns the ordered ids, and the tasks depending on each task.
+        """
+        pending = dict((task_id, len(set(deps)))
+                       for task_id, deps in dependencies.items())
+        depending = dict((task_id, []) for task_id in dependencies)
+        for task_id, deps in dependencies.items():
+            for dependency_id in set(deps):
+                depending[dependency_id].append(task_id)
+        ready = deque(task_id for task_id in self.ids
+                      if not pending[task_id])
+        order = []
+        while ready:
+            task_id = ready.popleft()
+            order.append(task_id)
+            for depending_id in depending[task_id]:
+                pending[depending_id] -= 1
+                if not pending[depending_id]:
+                    ready.append(depending_id)
+        if len(order) < len(dependencies):
+            raise Warning(_('Cannot recalculate project because there are '
+                            'circular dependencies between its tasks.'))
+        return order, depending
+
+    @api.multi
+    def task_recalculate_critical_path(self):
+        """
+            Recalculate task dates following their dependencies: a task
+            starts after the end of the tasks it depends on, and not
+            before the date given by its from_days.
+
+            Each project is planned on its own, against its own end (or
+            start) date: dependencies on tasks of other projects are
+            ignored. Tasks excluded from recalculation keep their dates,
+            and constrain the tasks depending on them.
+        """
+        calendars = {}
+        projects = {}
+        for task in self:
+            projects.setdefault(task.project_id.id, []).append(task.id)
+        dates = {}
+        earliest = {}
+        latest = {}
+        slack = {}
+        for task_ids in projects.values():
+            res = self.browse(task_ids)._critical_path_get(calendars)
+            for values, project_values in zip(
+                    (dates, earliest, latest, slack), res):
+                values.update(project_values)
+        self._task_dates_write(dates)
+        self._critical_path_store(earliest, latest, slack)
+        _logger.info('%d tasks recalculated by dependencies, working days '
+                     'cache: %s', len(self), cache_stats())
+        return True
+
+    def _critical_path_get(self, calendars):
+        """
+            Plan the tasks of a project following their dependencies.
+
+            Tasks are walked once in dependency order to plan them, and
+            once in the reverse order to get the other bound of their
+            start date, from the project end (or start) date: planning
+            from date begin gives earliest starts and latest starts are
+            derived, planning from date end the opposite. Slack days
+            between both give the critical path.
+
+            Returns the new dates of the recalculated tasks, and the
+            earliest starts, latest starts and slack days of all of them,
+            as dicts by task id.
+        """
+        cal = {}
+        dates = {}
+        for task in self:
+            cal[task.id] = task._calendar_get(calendars)[2]
+            if task.include_in_recalculate:
+                dates[task.id] = task._task_dates_get(cal[task.id])
+            else:
+                from_string = fields.Datetime.from_string
+                dates[task.id] = (from_string(task.date_start),
+                                  from_string(task.date_end))
+        if not dates:
+            return {}, {}, {}, {}
+        dependencies = self._dependencies_get()
+        order, depending = self._topological_sort(dependencies)
+        estimated = dict((task.id, task.estimated_days) for task in self)
+        moving = set(self.filtered('include_in_recalculate').ids)
+
+        def after(task_id, date):
+            # Start of the first working day of the task after date
+            intervals = cal[task_id].adjacent(date, 1)
+            return intervals and intervals[0][0] or False
+
+        def before(task_id, date):
+            # End of the last working day of the task before date
+            intervals = cal[task_id].adjacent(date, -1)
+            return intervals and intervals[-1][1] or False
+
+        def end_get(task_id, date_start):
+            end = cal[task_id].schedule(estimated[task_id], date_start)[1]
+            return end and end[1] or False
+
+        def start_get(task_id, date_end):
+            start = cal[task_id].schedule(-estimated[task_id], date_end)[1]
+            first = start and cal[task_id].first_interval(start[0])
+            return first and first[0] or False
+
+        forward = self[0].project_id.calculation_type == 'date_begin'
+        earliest = {}
+        latest = {}
+        if forward:
+            for task_id in order:
+                date_start, date_end = dates[task_id]
+                if task_id in moving and date_start:
+                    starts = [after(task_id, dates[dep_id][1])
+                              for dep_id in dependencies[task_id]
+                              if dates[dep_id][1]]
+                    date_start = max([date_start] + filter(None, starts))
+                    date_end = end_get(task_id, date_start)
+                    dates[task_id] = (date_start, date_end)
+                earliest[task_id] = date_start
+            finish = max(filter(None, [d[1] for d in dates.values()]) or
+                         [False])
+            for task_id in reversed(order):
+                date_end = finish
+                ends = [before(task_id, latest[dep_id])
+                        for dep_id in depending[task_id]
+                        if latest.get(dep_id)]
+                date_end = min([date_end] + filter(None, ends))
+                latest[task_id] = date_end and start_get(task_id, date_end)
+        else:
+            for task_id in reversed(order):
+                date_start, date_end = dates[task_id]
+                if task_id in moving and date_end:
+                    ends = [before(task_id, dates[dep_id][0])
+                            for dep_id in depending[task_id]
+                            if dates[dep_id][0]]
+                    date_end = min([date_end] + filter(None, ends))
+                    date_start = start_get(task_id, date_end)
+                    dates[task_id] = (date_start, date_end)
+                latest[task_id] = date_start
+            begin = min(filter(None, [d[0] for d in dates.values()]) or
+                        [False])
+            earliest_end = {}
+            for task_id in order:
+                starts = [after(task_id, earliest_end[dep_id])
+                          for dep_id in dependencies[task_id]
+                          if earliest_end.get(dep_id)]
+                date_start = max([begin] + filter(None, starts))
+                earliest[task_id] = date_start
+                earliest_end[task_id] = date_start and end_get(
+                    task_id, date_start)
+        slack = {}
+        for task_id in order:
+            if earliest[task_id] and latest[task_id]:
+                slack[task_id] = cal[task_id].count(
+                    earliest[task_id], latest[task_id])
+            else:
+                # Without dates, the task is not on the critical path
+                slack[task_id] = None
+        dates = dict((task_id, task_dates)
+                     for task_id, task_dates in dates.items()
+                     if task_id in moving)
+        return dates, earliest, latest, slack
+
+    def _critical_path_store(self, earliest, latest, slack):
+        """
+            Store earliest and latest starts, slack days and critical path
+            of the tasks with one query, as they are only computed here
+        """
+        to_string = fields.Datetime.to_string
+        cr = self.env.cr
+        rows = [cr.mogrify('(%s, %s::timestamp, %s::timestamp, %s, %s)', (
+            task_id,
+            earliest[task_id] and to_string(earliest[task_id]) or None,
+            latest[task_id] and to_string(latest[task_id]) or None,
+            slack[task_id] or 0, slack[task_id] == 0))
+            for task_id in slack]
+        if rows:
+            cr.execute("""
+                UPDATE project_task AS t
+                SET date_earliest_start = v.earliest,
+                    date_latest_start = v.latest,
+                    slack_days = v.slack,
+                    critical_path = v.critical
+                FROM (VALUES %s) AS v (id, earliest, latest, slack, critical)
+                WHERE t.id = v.id
+                """ % ', '.join(rows))
+        self.invalidate_cache(
+            ['date_earliest_start', 'date_latest_start', 'slack_days',
+             'critical_path'], list(slack))
+        return True
+
+    @api.multi
     def write(self, vals):
-        vals = self._dates_onchange(vals)
-        vals = self._estimated_days_prepare(vals)
-        return super(ProjectTask, self).write(vals)
+        """
+            Tasks getting the same estimated_days and from_days from the
+            written dates are written together
+        """
+        if not self._dates_changed(vals):
+            vals = self._estimated_days_prepare(dict(vals))
+            return super(ProjectTask, self).write(vals)
+        memo = {}
+        groups = {}
+        for task in self:
+            task_vals = task._dates_onchange(dict(vals), memo=memo)
+            key = tuple((name, task_vals[name])
+                        for name in ('estimated_days', 'from_days')
+                        if name in task_vals)
+            groups.setdefault(key, (task_vals, []))[1].append(task.id)
+        for task_vals, task_ids in groups.values():
+            task_vals = self._estimated_days_prepare(task_vals)
+            super(ProjectTask, self.browse(task_ids)).write(task_vals)
+        return True
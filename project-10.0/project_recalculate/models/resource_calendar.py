@@ -1,19 +1,149 @@
 # -*- coding: utf-8 -*-
 # See README.rst file on addon root folder for license details
 
-from openerp import models, api
-from datetime import datetime, timedelta
+from openerp import models, api, tools
+from datetime import datetime, time, timedelta
+from .calendar_days import cache_counters
 
 
 class ResourceCalendar(models.Model):
     _inherit = 'resource.calendar'
 
+    @api.v7
+    def _get_cache_signature(self, cr, uid, calendar_id, context=None):
+        """
+            Version of a working calendar, that changes whenever the
+            calendar, its attendances or its leaves are created, written
+            or unlinked. It is part of the cache keys, so that cached
+            values of a modified calendar are not used again, by any
+            server process.
+        """
+        if not calendar_id:
+            return False
+        cr.execute("""
+            SELECT (SELECT write_date FROM resource_calendar
+                    WHERE id = %(id)s),
+                   att.last, att.count, lv.last, lv.count
+            FROM (SELECT max(write_date) AS last, count(*) AS count
+                  FROM resource_calendar_attendance
+                  WHERE calendar_id = %(id)s) AS att,
+                 (SELECT max(write_date) AS last, count(*) AS count
+                  FROM resource_calendar_leaves
+                  WHERE calendar_id = %(id)s) AS lv
+            """, {'id': calendar_id})
+        return tuple(cr.fetchone())
+
+    @api.v7
+    def _day_intervals_get(self, cr, uid, calendar_id, resource_id, day, tz,
+                           default_interval, signature):
+        """
+            Working intervals of a date, as a tuple, computed in timezone
+            tz. ``signature`` is the one of the calendar, see
+            ``_get_cache_signature``.
+        """
+        cache_counters['lookups'] += 1
+        return self._day_intervals_cached(
+            cr, uid, calendar_id, resource_id, day, tz, default_interval,
+            signature)
+
+    @api.v7
+    @tools.ormcache(skiparg=3)
+    def _day_intervals_cached(self, cr, uid, calendar_id, resource_id, day,
+                              tz, default_interval, signature):
+        # Cached per arguments after uid, all of them positional
+        cache_counters['misses'] += 1
+        intervals = self.get_working_intervals_of_day(
+            cr, uid, calendar_id, start_dt=datetime.combine(day, time()),
+            compute_leaves=True, resource_id=resource_id,
+            default_interval=default_interval,
+            context=tz and {'tz': tz} or {})
+        return tuple(intervals)
+
     @api.v7
     def get_working_days_of_date(self, cr, uid, id, start_dt=None, end_dt=None,
                                  leaves=None, compute_leaves=False,
                                  resource_id=None, default_interval=None,
                                  context=None):
-        context = dict(context) or {}
+        """
+            Number of days with working intervals from start_dt to end_dt,
+            each day being looked at from the start_dt time.
+
+            Days are counted arithmetically from the calendar weekly
+            pattern, full weeks at once, minus the days covered by leaves.
+            Only the first and last days, and the days partially covered
+            by leaves, are checked with get_working_intervals_of_day.
+        """
+        context = dict(context or {})
+        context['tz'] = 'UTC'
+        if start_dt is None:
+            start_dt = datetime.now().replace(hour=0, minute=0, second=0)
+        if end_dt is None:
+            end_dt = datetime.now().replace(hour=23, minute=59, second=59)
+        if end_dt < start_dt:
+            return 0
+        total = (end_dt - start_dt).days + 1
+        if id is None:
+            return total
+        calendar = self.browse(cr, uid, id, context=context)
+        if total <= 2 or any(att.date_from
+                             for att in calendar.attendance_ids):
+            return self._get_working_days_of_date_loop(
+                cr, uid, id, start_dt=start_dt, end_dt=end_dt, leaves=leaves,
+                compute_leaves=compute_leaves, resource_id=resource_id,
+                default_interval=default_interval, context=context)
+
+        def is_working(current):
+            end_day = current.replace(hour=23, minute=59, second=59)
+            end = end_dt if end_day > end_dt else end_day
+            return bool(self.get_working_intervals_of_day(
+                cr, uid, id, start_dt=current, end_dt=end, leaves=leaves,
+                compute_leaves=compute_leaves, resource_id=resource_id,
+                default_interval=default_interval, context=context))
+
+        first = start_dt + timedelta(days=1)
+        last = start_dt + timedelta(days=total - 2)
+        days = int(is_working(start_dt))
+        days += int(is_working(start_dt + timedelta(days=total - 1)))
+
+        # Weekdays with working intervals after the start_dt time
+        start_hour = (start_dt.hour + start_dt.minute / 60.0 +
+                      start_dt.second / 3600.0)
+        weekdays = set(int(att.dayofweek) for att in calendar.attendance_ids
+                       if att.hour_to > max(att.hour_from, start_hour))
+        weeks, remainder = divmod(total - 2, 7)
+        days += weeks * len(weekdays)
+        days += len([i for i in range(remainder)
+                     if (first.weekday() + i) % 7 in weekdays])
+
+        if leaves is None and compute_leaves:
+            leaves = self.get_leave_intervals(
+                cr, uid, id, resource_id=resource_id, context=context)
+        covered, partial = set(), set()
+        for leave_from, leave_to in leaves or []:
+            day = max(leave_from.date(), first.date())
+            while day <= min(leave_to.date(), last.date()):
+                if day.weekday() in weekdays:
+                    current = datetime.combine(day, start_dt.time())
+                    if (leave_from <= current and
+                            leave_to >= current.replace(
+                                hour=23, minute=59, second=59)):
+                        covered.add(day)
+                    else:
+                        partial.add(day)
+                day += timedelta(days=1)
+        days -= len(covered)
+        for day in partial - covered:
+            if not is_working(datetime.combine(day, start_dt.time())):
+                days -= 1
+        return days
+
+    @api.v7
+    def _get_working_days_of_date_loop(self, cr, uid, id, start_dt=None,
+                                       end_dt=None, leaves=None,
+                                       compute_leaves=False, resource_id=None,
+                                       default_interval=None, context=None):
+        """ Day by day version of get_working_days_of_date """
+        context = dict(context or {})
         context['tz'] = 'UTC'
         if start_dt is None:
             start_dt = datetime.now().replace(hour=0, minute=0, second=0)
@@ -36,3 +166,4 @@ class ResourceCalendar(models.Model):
             next = current + timedelta(days=1)
             current = next
         return days
+
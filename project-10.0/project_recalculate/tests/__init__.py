@@ -3,3 +3,4 @@
 
 from . import test_project_project
 from . import test_project_task
+from . import test_resource_calendar
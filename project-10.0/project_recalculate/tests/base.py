@@ -109,6 +109,7 @@ class BaseCase(TransactionCase):
         calendar = m_calendar.create({
             'name': 'Test calendar',
         })
+        self.calendar = calendar
         # Working days
         #   - L-V 8:00 to 18:00
         days = (
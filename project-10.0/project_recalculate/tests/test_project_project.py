@@ -93,7 +93,8 @@ class TestProjectProjectBegin(base.BaseCase):
     #   * With no tasks
     #   * With one task
     #   * With several tasks
-    def _project_recalculate(self, num_tasks, res_project, res_tasks):
+    def _project_recalculate(self, num_tasks, res_project, res_tasks,
+                             use_task_dependencies=False):
         """
         @summary: Check project_recalculate method
             * With no tasks
@@ -102,8 +103,10 @@ class TestProjectProjectBegin(base.BaseCase):
         @param num_tasks: Number of task to create in test project
         @param res_project: Project dates expected
         @param res_tasks: Tasks dates expected
-        @result:
+        @param use_task_dependencies: Recalculate following dependencies
+        @result: Recalculated projects
         """
+        projects = self.env['project.project']
         counter = 0
         for name, start, end in self.project_init_dates:
             # Create project with 'num_tasks' tasks
@@ -112,7 +115,9 @@ class TestProjectProjectBegin(base.BaseCase):
                 'name': name,
                 'date_start': start,
                 'date': end,
+                'use_task_dependencies': use_task_dependencies,
             })
+            projects |= project
             # Set days (estimated_days and from_days to tasks)
             self.project_task_days_set(
                 project, self.task_days[self.calculation_type])
@@ -136,6 +141,7 @@ class TestProjectProjectBegin(base.BaseCase):
                     task.date_end[:DATE_LENGTH], dates[2],
                     "[%d, %d] FAIL: task date_end" % (counter, i))
             counter += 1
+        return projects
 
     def test_project_recalculate_no_task(self):
         self._project_recalculate(
@@ -149,6 +155,82 @@ class TestProjectProjectBegin(base.BaseCase):
         self._project_recalculate(
             self.num_tasks, self.project_dates_res['tasks'], self.task_dates)
 
+    def test_project_recalculate_critical_path(self):
+        """
+        @summary: Check project_recalculate following task dependencies:
+            without dependencies, tasks get the same dates, and the tasks
+            reaching the project end (or start) date are critical
+        """
+        projects = self._project_recalculate(
+            self.num_tasks, self.project_dates_res['tasks'], self.task_dates,
+            use_task_dependencies=True)
+        for project in projects:
+            if self.calculation_type == 'date_begin':
+                bound = max(project.tasks, key=lambda t: t.date_end)
+            else:
+                bound = min(project.tasks, key=lambda t: t.date_start)
+            self.assertTrue(bound.critical_path,
+                            "FAIL: %s not critical" % bound.name)
+            for task in project.tasks:
+                self.assertEqual(
+                    task.critical_path, task.slack_days == 0,
+                    "FAIL: %s critical_path" % task.name)
+                self.assertTrue(
+                    task.date_earliest_start <= task.date_latest_start,
+                    "FAIL: %s latest start" % task.name)
+
+    def test_project_recalculate_critical_path_dependencies(self):
+        """
+        @summary: Check project_recalculate following a task dependency:
+            the depending task starts after the end of the task it depends
+            on, both are critical, and the other tasks have slack days
+        """
+        chains = {
+            # task, depending task
+            'date_begin': ('task_3', 'task_4'),
+            'date_end': ('task_4', 'task_0'),
+        }
+        name, start, end = self.project_init_dates[2]
+        project = self.project_create(self.num_tasks, {
+            'calculation_type': self.calculation_type,
+            'name': name,
+            'date_start': start,
+            'date': end,
+            'use_task_dependencies': True,
+        })
+        self.project_task_days_set(
+            project, self.task_days[self.calculation_type])
+        tasks = dict((t.name, t) for t in project.tasks)
+        dependency, depending = [
+            tasks[n] for n in chains[self.calculation_type]]
+
+        def dependencies_get(records):
+            res = dict((task_id, []) for task_id in records.ids)
+            if depending.id in res and dependency.id in res:
+                res[depending.id].append(dependency.id)
+            return res
+
+        task_class = type(self.env['project.task'])
+        task_class._dependencies_get = dependencies_get
+        try:
+            project.project_recalculate()
+        finally:
+            del task_class._dependencies_get
+        self.assertTrue(depending.date_start > dependency.date_end,
+                        "FAIL: depending task starts before the end of "
+                        "its dependency")
+        for task in project.tasks:
+            if task in (dependency, depending):
+                self.assertTrue(task.critical_path,
+                                "FAIL: %s not critical" % task.name)
+                self.assertEqual(task.slack_days, 0,
+                                 "FAIL: %s slack days" % task.name)
+            else:
+                self.assertFalse(task.critical_path,
+                                 "FAIL: %s critical" % task.name)
+                self.assertTrue(task.slack_days > 0,
+                                "FAIL: %s slack days" % task.name)
+
     def test_project_recalculate_exceptions(self):
         """
         @summary: Check exception raised when "Recalculate project"
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 # See README.rst file on addon root folder for license details
 
-from openerp.exceptions import ValidationError
+from openerp.exceptions import ValidationError, Warning
 from . import base
 
 
@@ -100,6 +100,52 @@ class TestProjectTaskBegin(base.BaseCase):
                 task_counter += 1
             project_counter += 1
 
+    def test_write_multi(self):
+        """
+        @summary: Check a multi-record dates write gets the same
+            estimated_days and from_days as record by record writes
+        """
+        name, start, end = self.project_init_dates[2]
+        project = self.project_create(self.num_tasks, {
+            'calculation_type': self.calculation_type,
+            'name': name,
+            'date_start': start,
+            'date': end,
+        })
+        vals = {
+            'date_start': '2015-08-07 08:00:00',
+            'date_end': '2015-08-21 18:00:00',
+        }
+        expected = project.tasks[0]._dates_onchange(dict(vals))
+        project.tasks.write(vals)
+        for task in project.tasks:
+            self.assertEqual(task.estimated_days, expected['estimated_days'],
+                             "FAIL: estimated_days of %s" % task.name)
+            self.assertEqual(task.from_days, expected['from_days'],
+                             "FAIL: from_days of %s" % task.name)
+
+    def test_topological_sort(self):
+        """
+        @summary: Check tasks are ordered after the tasks they depend on,
+            and circular dependencies are refused
+        """
+        project = self.project_create(self.num_tasks, {
+            'calculation_type': self.calculation_type,
+            'name': 'Test project',
+        })
+        t0, t1, t2, t3, t4 = project.tasks.sorted(key=lambda t: t.name).ids
+        dependencies = {t0: [t2], t1: [], t2: [t1, t3], t3: [t1], t4: []}
+        order, depending = project.tasks._topological_sort(dependencies)
+        self.assertEqual(sorted(order), sorted(dependencies))
+        for task_id, deps in dependencies.items():
+            for dependency_id in deps:
+                self.assertTrue(
+                    order.index(dependency_id) < order.index(task_id))
+                self.assertTrue(task_id in depending[dependency_id])
+        dependencies[t1] = [t0]
+        with self.assertRaises(Warning):
+            project.tasks._topological_sort(dependencies)
+
     def test_estimated_days_check(self):
         """
         @summary: Check _estimated_days_check constraint
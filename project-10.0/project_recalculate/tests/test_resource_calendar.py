@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# See README.rst file on addon root folder for license details
+
+import logging
+import time
+from datetime import datetime
+from . import base
+from ..models.calendar_days import CalendarDays
+
+_logger = logging.getLogger(__name__)
+
+
+class TestResourceCalendar(base.BaseCase):
+
+    def working_days(self, method, start, end, **kwargs):
+        rc = self.registry['resource.calendar']
+        return getattr(rc, method)(
+            self.cr, self.uid, self.calendar.id,
+            start_dt=datetime.strptime(start, '%Y-%m-%d %H:%M:%S'),
+            end_dt=datetime.strptime(end, '%Y-%m-%d %H:%M:%S'),
+            compute_leaves=True, context={}, **kwargs)
+
+    def test_working_days_of_date(self):
+        """
+        @summary: Check get_working_days_of_date against the day by day loop
+        """
+        cases = (
+            # start, end
+            ('2015-08-03 08:00:00', '2015-08-03 18:00:00'),
+            ('2015-08-03 08:00:00', '2015-08-04 10:00:00'),
+            ('2015-08-01 00:00:00', '2015-08-31 23:59:59'),
+            ('2015-08-03 08:00:00', '2015-08-14 18:00:00'),
+            ('2015-08-03 17:00:00', '2015-10-20 07:00:00'),  # after work
+            ('2015-07-30 12:00:00', '2015-10-17 12:00:00'),
+            ('2015-08-14 00:00:00', '2015-08-18 00:00:00'),  # with leave
+            ('2015-10-17 00:00:00', '2015-08-01 00:00:00'),  # end < start
+        )
+        for start, end in cases:
+            self.assertEqual(
+                self.working_days('get_working_days_of_date', start, end),
+                self.working_days(
+                    '_get_working_days_of_date_loop', start, end),
+                "FAIL: %s - %s" % (start, end))
+
+    def test_working_days_of_date_leaves(self):
+        """
+        @summary: Check get_working_days_of_date against the day by day loop
+            with leaves on working days, covering them or not
+        """
+        leaves = (
+            # name, date_from, date_to
+            # covers the working hours, but not the whole day
+            ('Wednesday', '2015-09-09 07:00:00', '2015-09-09 17:00:00'),
+            # covers only some of the working hours
+            ('Thursday', '2015-09-17 10:00:00', '2015-09-17 12:00:00'),
+            # from Friday noon to Tuesday morning
+            ('Weekend', '2015-09-25 12:00:00', '2015-09-29 09:00:00'),
+        )
+        for name, date_from, date_to in leaves:
+            self.env['resource.calendar.leaves'].create({
+                'name': name,
+                'calendar_id': self.calendar.id,
+                'date_from': date_from,
+                'date_to': date_to,
+            })
+        cases = (
+            # start, end
+            ('2015-10-05 08:00:00', '2015-10-16 18:00:00'),  # 12 Octubre
+            ('2015-10-12 08:00:00', '2015-10-13 18:00:00'),
+            ('2015-09-01 08:00:00', '2015-10-31 18:00:00'),
+            ('2015-09-07 11:00:00', '2015-09-18 11:00:00'),
+            ('2015-09-08 00:00:00', '2015-09-10 23:59:59'),
+            ('2015-09-16 13:00:00', '2015-09-30 13:00:00'),
+            ('2015-09-24 08:00:00', '2015-10-14 18:00:00'),
+        )
+        for start, end in cases:
+            self.assertEqual(
+                self.working_days('get_working_days_of_date', start, end),
+                self.working_days(
+                    '_get_working_days_of_date_loop', start, end),
+                "FAIL: %s - %s" % (start, end))
+
+    def test_working_days_of_date_benchmark(self):
+        """
+        @summary: Benchmark get_working_days_of_date on a 3 years span
+        """
+        start, end = '2015-01-01 08:00:00', '2017-12-31 18:00:00'
+        timings = {}
+        for method in ('get_working_days_of_date',
+                       '_get_working_days_of_date_loop'):
+            started = time.time()
+            res = self.working_days(method, start, end)
+            timings[method] = (time.time() - started, res)
+        fast, loop = (timings['get_working_days_of_date'],
+                      timings['_get_working_days_of_date_loop'])
+        _logger.info('Working days of a 3 years span: %.2fms instead of '
+                     '%.2fms with the day by day loop',
+                     fast[0] * 1000, loop[0] * 1000)
+        self.assertEqual(fast[1], loop[1])
+
+    def test_day_intervals_cache(self):
+        """
+        @summary: Check the working intervals cache and its invalidation
+        """
+        day = datetime(2015, 8, 5)
+        rc = self.registry['resource.calendar']
+        intervals_of_day = rc.get_working_intervals_of_day
+        calls = []
+
+        def counted_intervals_of_day(*args, **kwargs):
+            calls.append(args)
+            return intervals_of_day(*args, **kwargs)
+
+        rc.get_working_intervals_of_day = counted_intervals_of_day
+        try:
+            first = CalendarDays(self.env, self.calendar).intervals(day)
+            self.assertTrue(first)
+            self.assertEqual(
+                CalendarDays(self.env, self.calendar).intervals(day), first)
+            # The second lookup is served by the cache
+            self.assertTrue(len(calls) <= 1)
+            before = len(calls)
+            self.env['resource.calendar.leaves'].create({
+                'name': 'Cache leave',
+                'calendar_id': self.calendar.id,
+                'date_from': '2015-08-04 12:00:00',
+                'date_to': '2015-08-06 12:00:00',
+            })
+            self.assertFalse(
+                CalendarDays(self.env, self.calendar).intervals(day))
+            # The new leave changed the calendar signature
+            self.assertEqual(len(calls), before + 1)
+        finally:
+            del rc.get_working_intervals_of_day
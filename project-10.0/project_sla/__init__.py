@@ -2,6 +2,10 @@
 from . import project_sla
 from . import analytic_account
 from . import project_sla_control
+from . import project_sla_event
+from . import project_sla_queue
+from . import project_sla_reapply
 from . import project_issue
 from . import project_task
+from . import resource_calendar
 from . import report
@@ -94,6 +94,17 @@ default calendar is used.
 A timezone and leave calendars will  also used, based on either the assigned
 user (document's `user_id`) or on the current user.
 
+Stages can be set to "Pause SLA", for example for a "Waiting for customer"
+stage: the SLA clock is stopped while documents are in such a stage, and the
+warning and limit dates are cleared until it is resumed. The clock events
+(started, paused, resumed, closed) are logged with the working hours consumed
+so far, and SLA dates are computed from the last one.
+
+SLA recomputation can be deferred to a scheduled job, by setting the
+``project_sla.deferred`` system parameter. The recomputation queue is best
+used with PostgreSQL 9.5 or later: older versions are supported, but the
+workers draining the queue then wait for each other.
+
 
 Setup checklist
 ===============
@@ -122,6 +133,7 @@ Credits and Contributors
         'project_sla_view.xml',
         'project_sla_control_view.xml',
         'project_sla_control_data.xml',
+        'project_sla_reapply_view.xml',
         'analytic_account_view.xml',
         'project_view.xml',
         'project_issue_view.xml',
@@ -31,35 +31,79 @@ class AnalyticAccount(orm.Model):
             'project.sla', string='Service Level Agreement'),
         }
 
-    def _reapply_sla(self, cr, uid, ids, recalc_closed=False, context=None):
+    def _get_sla_doc_ids(self, cr, uid, ids, recalc_closed=False,
+                         context=None):
+        """
+        Returns the documents subject to the SLAs of the Contracts, as a
+        dict {model_name: [doc_ids]}, with one search per controlled model.
+        """
+        res = {}
+        contracts_per_model = {}
+        for contract in self.browse(cr, uid, ids, context=context):
+            for sla in contract.sla_ids:
+                contracts_per_model.setdefault(
+                    sla.control_model, set()).add(contract.id)
+        for model_name, contract_ids in contracts_per_model.items():
+            model = self.pool[model_name]
+            contract_ids = list(contract_ids)
+            domain = []
+            if 'analytic_account_id' in model._columns:
+                domain.append(('analytic_account_id', 'in', contract_ids))
+            if 'project_id' in model._columns:
+                domain.append(
+                    ('project_id.analytic_account_id', 'in', contract_ids))
+            if not domain:
+                continue
+            domain = ['|'] * (len(domain) - 1) + domain
+            if not recalc_closed:
+                domain = [('stage_id.fold', '=', 0)] + domain
+            doc_ids = model.search(cr, uid, domain, context=context)
+            if doc_ids:
+                res[model_name] = doc_ids
+        return res
+
+    def _reapply_sla(self, cr, uid, ids, recalc_closed=False, chunked=False,
+                     workers=1, context=None):
         """
         Force SLA recalculation on open documents that already are subject to
         this SLA Definition.
         To use after changing a Contract SLA or it's Definitions.
         The ``recalc_closed`` flag allows to also recompute closed documents.
+
+        The ``chunked`` flag processes the documents in background jobs,
+        committing after each chunk, split in ``workers`` partitions that
+        are run in parallel by the scheduler workers. Interrupted jobs can
+        be resumed from their last checkpoint.
         """
         ctrl_obj = self.pool['project.sla.control']
-        for contract in self.browse(cr, uid, ids, context=context):
-            # for each contract, and for each model under SLA control ...
-            ctrl_models = set([sla.control_model for sla in contract.sla_ids])
-            for model_name in ctrl_models:
+        job_obj = self.pool['project.sla.reapply.job']
+        doc_ids = self._get_sla_doc_ids(
+            cr, uid, ids, recalc_closed=recalc_closed, context=context)
+        for model_name, model_doc_ids in doc_ids.items():
+            if chunked:
+                job_obj.create_jobs(
+                    cr, uid, model_name, model_doc_ids, workers=workers,
+                    context=context)
+            else:
                 model = self.pool[model_name]
-                base = [] if recalc_closed else [('stage_id.fold', '=', 0)]
-                doc_ids = []
-                if 'analytic_account_id' in model._columns:
-                    domain = base + [
-                        ('analytic_account_id', '=', contract.id)]
-                    doc_ids += model.search(cr, uid, domain, context=context)
-                if 'project_id' in model._columns:
-                    domain = base + [
-                        ('project_id.analytic_account_id', '=', contract.id)]
-                    doc_ids += model.search(cr, uid, domain, context=context)
-                if doc_ids:
-                    model = self.pool[model_name]
-                    docs = model.browse(cr, uid, doc_ids, context=context)
-                    ctrl_obj.store_sla_control(cr, uid, docs, context=context)
+                docs = model.browse(cr, uid, model_doc_ids, context=context)
+                ctrl_obj.store_sla_control(cr, uid, docs, context=context)
         return True
 
     def reapply_sla(self, cr, uid, ids, context=None):
         """ Reapply SLAs button action """
         return self._reapply_sla(cr, uid, ids, context=context)
+
+    def reapply_sla_chunked(self, cr, uid, ids, context=None):
+        """
+        Reapply SLAs in background button action: opens the SLA Reapply
+        Jobs created
+        """
+        job_obj = self.pool['project.sla.reapply.job']
+        self._reapply_sla(
+            cr, uid, ids, chunked=True,
+            workers=job_obj.get_workers(cr, uid, context=context),
+            context=context)
+        return self.pool['ir.actions.act_window'].for_xml_id(
+            cr, uid, 'project_sla', 'action_sla_reapply_job',
+            context=context)
@@ -45,23 +45,43 @@ class SLADefinition(orm.Model):
         'active': True,
         }
 
-    def _reapply_slas(self, cr, uid, ids, recalc_closed=False, context=None):
+    def _reapply_slas(self, cr, uid, ids, recalc_closed=False,
+                      chunked=False, workers=1, context=None):
         """
         Force SLA recalculation on all _open_ Contracts for the selected SLAs.
         To use upon SLA Definition modifications.
+        See ``account.analytic.account._reapply_sla`` for the ``chunked``
+        and ``workers`` options.
         """
         contract_obj = self.pool.get('account.analytic.account')
+        contr_ids = set()
         for sla in self.browse(cr, uid, ids, context=context):
-            contr_ids = [x.id for x in sla.analytic_ids if x.state == 'open']
+            contr_ids.update(
+                x.id for x in sla.analytic_ids if x.state == 'open')
+        if contr_ids:
             contract_obj._reapply_sla(
-                cr, uid, contr_ids, recalc_closed=recalc_closed,
-                context=context)
+                cr, uid, list(contr_ids), recalc_closed=recalc_closed,
+                chunked=chunked, workers=workers, context=context)
         return True
 
     def reapply_slas(self, cr, uid, ids, context=None):
         """ Reapply SLAs button action """
         return self._reapply_slas(cr, uid, ids, context=context)
 
+    def reapply_slas_chunked(self, cr, uid, ids, context=None):
+        """
+        Reapply SLAs in background button action: opens the SLA Reapply
+        Jobs created
+        """
+        job_obj = self.pool['project.sla.reapply.job']
+        self._reapply_slas(
+            cr, uid, ids, chunked=True,
+            workers=job_obj.get_workers(cr, uid, context=context),
+            context=context)
+        return self.pool['ir.actions.act_window'].for_xml_id(
+            cr, uid, 'project_sla', 'action_sla_reapply_job',
+            context=context)
+
 
 class SLARules(orm.Model):
     """
@@ -19,39 +19,32 @@
 ##############################################################################
 
 from openerp.osv import fields, orm
-from openerp.tools.safe_eval import safe_eval
 from openerp.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT as DT_FMT
 from openerp import SUPERUSER_ID
 from datetime import datetime as dt
-from . import m2m
+from .sla_calendar import cache_stats, day_periods, period_end
+from .sla_condition import get_condition, condition_fields
+from .project_sla_event import SLA_RUNNING_EVENTS
 
 import logging
+import time
 _logger = logging.getLogger(__name__)
 
 
 SLA_STATES = [('5', 'Failed'), ('4', 'Will Fail'), ('3', 'Warning'),
               ('2', 'Watching'), ('1', 'Achieved')]
 
+# System parameter holding the date of the last SLA states update
+SLA_SWEEP_PARAM = 'project_sla.sweep_date'
+# Time taken back from the last SLA states update date on each sweep
+SLA_SWEEP_OVERLAP = '15 minutes'
 
-def safe_getattr(obj, dotattr, default=False):
-    """
-    Follow an object attribute dot-notation chain to find the leaf value.
-    If any attribute doesn't exist or has no value, just return False.
-    Checks hasattr ahead, to avoid ORM Browse log warnings.
-    """
-    attrs = dotattr.split('.')
-    while attrs:
-        attr = attrs.pop(0)
-        if attr in obj._model._columns:
-            try:
-                obj = getattr(obj, attr)
-            except AttributeError:
-                return default
-            if not obj:
-                return default
-        else:
-            return default
-    return obj
+# Document fields every SLA depends on, besides the SLA Definition control
+# date field and the fields used in the SLA Rule conditions
+SLA_DEPENDS = ('user_id', 'project_id', 'analytic_account_id', 'create_date')
+
+# Number of documents computed and stored at once by the batch SLA engine
+SLA_CHUNK_SIZE = 1000
 
 
 class SLAControl(orm.Model):
@@ -81,6 +74,56 @@ class SLAControl(orm.Model):
             # Future: perfect SLA manual handling
         }
 
+    def _auto_init(self, cr, context=None):
+        res = super(SLAControl, self)._auto_init(cr, context=context)
+        # Composite indexes used by the SLA state sweeper
+        for field in ('sla_limit_date', 'sla_warn_date'):
+            index = 'project_sla_control_state_%s_index' % field
+            cr.execute("SELECT indexname FROM pg_indexes "
+                       "WHERE indexname = %s", (index,))
+            if not cr.fetchone():
+                cr.execute("CREATE INDEX %s ON project_sla_control "
+                           "(sla_state, %s)" % (index, field))
+        # Ids of deleted SLA Controls, removed from the materialized SLA
+        # report on its next refresh
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS project_sla_control_deleted (
+                control_id integer NOT NULL)""")
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        for sub_ids in cr.split_for_in_conditions(ids):
+            cr.execute("""
+                INSERT INTO project_sla_control_deleted (control_id)
+                SELECT id FROM project_sla_control WHERE id IN %s
+                """, (sub_ids,))
+        return super(SLAControl, self).unlink(cr, uid, ids, context=context)
+
+    def _propagate_sla_state(self, cr, uid, docs, new_state, context=None):
+        """
+        Raise the SLA State of controlled documents to ``new_state``, when
+        lower, with one UPDATE per document model.
+        ``docs`` is a list of (doc_model, doc_id) pairs.
+        """
+        doc_ids = {}
+        for doc_model, doc_id in docs:
+            doc_ids.setdefault(doc_model, set()).add(doc_id)
+        for doc_model, ids in doc_ids.items():
+            model = self.pool.get(doc_model)
+            if model is None:
+                continue
+            for sub_ids in cr.split_for_in_conditions(ids):
+                cr.execute("""
+                    UPDATE %s SET sla_state = %%s
+                    WHERE id IN %%s
+                      AND (sla_state IS NULL OR sla_state < %%s)
+                    """ % model._table, (new_state, sub_ids, new_state))
+        if doc_ids:
+            self.invalidate_cache(cr, uid, context=context)
+        return True
+
     def write(self, cr, uid, ids, vals, context=None):
         """
         Update the related Document's SLA State when any of the SLA Control
@@ -89,17 +132,40 @@ class SLAControl(orm.Model):
         res = super(SLAControl, self).write(
             cr, uid, ids, vals, context=context)
         new_state = vals.get('sla_state')
-        if new_state:
+        if new_state and ids:
             # just update sla_state without recomputing the whole thing
-            ctx = dict(context) if context else {}
-            ctx['__sla_stored__'] = 1
-            for sla in self.browse(cr, uid, ids, context=ctx):
-                doc = self.pool.get(sla.doc_model).browse(
-                    cr, uid, sla.doc_id, context=ctx)
-                if doc.sla_state < new_state:
-                    doc.write({'sla_state': new_state})
+            if isinstance(ids, (int, long)):
+                ids = [ids]
+            cr.execute("SELECT doc_model, doc_id FROM project_sla_control "
+                       "WHERE id IN %s", (tuple(ids),))
+            self._propagate_sla_state(
+                cr, uid, cr.fetchall(), new_state, context=context)
         return res
 
+    def _sweep_sla_states(self, cr, uid, states, date_field, since, now,
+                          new_state, context=None):
+        """
+        Set ``new_state`` on the SLA Controls in one of ``states`` whose
+        ``date_field`` was crossed in the [since, now) period, and propagate
+        it to the controlled documents.
+        ``since`` can be None to sweep all the past dates.
+        """
+        query = """
+            UPDATE project_sla_control
+            SET sla_state = %%s,
+                write_uid = %%s,
+                write_date = (now() at time zone 'UTC')
+            WHERE sla_state IN %%s AND %(field)s < %%s
+            """ % {'field': date_field}
+        params = [new_state, uid, tuple(states), now]
+        if since:
+            query += " AND %s >= %%s" % date_field
+            params.append(since)
+        cr.execute(query + " RETURNING doc_model, doc_id", params)
+        docs = cr.fetchall()
+        self._propagate_sla_state(cr, uid, docs, new_state, context=context)
+        return len(docs)
+
     def update_sla_states(self, cr, uid, context=None):
         """
         Updates SLA States, given the current datetime:
@@ -107,43 +173,274 @@ class SLAControl(orm.Model):
           - exceeded limit date are set to "will fail"
           - exceeded warning dates are set to "warning"
         To be used by a scheduled job.
+
+        Only the dates crossed since the previous run, stored as a
+        high-water mark in the ``project_sla.sweep_date`` system parameter,
+        are looked at. The mark is taken from the database clock, and a
+        ``SLA_SWEEP_OVERLAP`` is taken back from it, to also catch dates
+        committed by transactions still running at that time: sweeping a
+        control again doesn't change it.
         """
-        now = dt.strftime(dt.now(), DT_FMT)
+        param_obj = self.pool['ir.config_parameter']
+        since = param_obj.get_param(cr, SUPERUSER_ID, SLA_SWEEP_PARAM)
+        cr.execute("SELECT (now() at time zone 'UTC'), "
+                   "       %s::timestamp - %s::interval",
+                   (since or None, SLA_SWEEP_OVERLAP))
+        now, since = [value and dt.strftime(value, DT_FMT)
+                      for value in cr.fetchone()]
         # SLAs to mark as "will fail"
-        control_ids = self.search(
-            cr, uid,
-            [('sla_state', 'in', ['2', '3']), ('sla_limit_date', '<', now)],
+        failing = self._sweep_sla_states(
+            cr, uid, ['2', '3'], 'sla_limit_date', since, now, '4',
             context=context)
-        self.write(cr, uid, control_ids, {'sla_state': '4'}, context=context)
         # SLAs to mark as "warning"
-        control_ids = self.search(
-            cr, uid,
-            [('sla_state', 'in', ['2']), ('sla_warn_date', '<', now)],
+        warning = self._sweep_sla_states(
+            cr, uid, ['2'], 'sla_warn_date', since, now, '3',
             context=context)
-        self.write(cr, uid, control_ids, {'sla_state': '3'}, context=context)
+        param_obj.set_param(cr, SUPERUSER_ID, SLA_SWEEP_PARAM, now)
+        _logger.info('SLA states updated: %d will fail, %d warning',
+                     failing, warning)
         return True
 
+    def _get_calendar_cache_key(self, cr, uid, calendar_id, context=None):
+        """
+        Return the (timezone, calendar signature) used to look up the
+        cached working intervals of a calendar's days. It can be computed
+        once for many ``_compute_sla_date`` calls.
+        """
+        tz = (context or {}).get('tz') or self.pool['res.users'].browse(
+            cr, SUPERUSER_ID, uid, context=context).tz or False
+        signature = self.pool['resource.calendar']._get_cache_signature(
+            cr, uid, calendar_id, context=context)
+        return tz, signature
+
     def _compute_sla_date(self, cr, uid, calendar_id, resource_id,
-                          start_date, hours, context=None):
+                          start_date, hours, cache_key=None, context=None):
         """
         Return a limit datetime by adding hours to a start_date, honoring
         a working_time calendar and a resource's (res_uid) timezone and
         availability (leaves)
+
+        The working intervals of each day are cached, so that all the
+        documents scheduled over the same days share the same calendar
+        computation. ``cache_key`` is the result of
+        ``_get_calendar_cache_key``, computed if not given.
         """
         assert isinstance(start_date, dt)
-        assert isinstance(hours, int) and hours >= 0
+        assert isinstance(hours, (int, long, float)) and hours >= 0
 
         cal_obj = self.pool.get('resource.calendar')
-        periods = cal_obj._schedule_hours(
-            cr, uid, calendar_id,
-            hours,
-            day_dt=start_date,
+        if not hours:
+            periods = cal_obj._schedule_hours(
+                cr, uid, calendar_id,
+                hours,
+                day_dt=start_date,
+                compute_leaves=True,
+                resource_id=resource_id,
+                default_interval=(8, 16),
+                context=context)
+            return periods[-1][1]
+
+        tz, signature = cache_key or self._get_calendar_cache_key(
+            cr, uid, calendar_id, context=context)
+
+        def intervals_of_day(day):
+            return cal_obj._sla_day_intervals(
+                cr, uid, calendar_id, resource_id, day, tz, signature)
+
+        return period_end(day_periods(intervals_of_day, start_date),
+                          start_date, hours)
+
+    def _compute_consumed_hours(self, cr, uid, calendar_id, resource_id,
+                                start_date, end_date, context=None):
+        """
+        Return the working hours between two datetimes, honoring the same
+        calendar, resource timezone and leaves as ``_compute_sla_date``.
+        """
+        if end_date <= start_date:
+            return 0.0
+        return self.pool['resource.calendar'].get_working_hours(
+            cr, uid, calendar_id, start_date, end_date,
             compute_leaves=True,
             resource_id=resource_id,
             default_interval=(8, 16),
             context=context)
-        end_date = periods[-1][1]
-        return end_date
+
+    def _get_sla_rules(self, cr, uid, doc, context=None):
+        """
+        Returns the list of (SLA Definition, SLA Rule) browse record pairs
+        applying to the target document: for each SLA Definition, the first
+        rule, in sequence order, whose condition is met.
+        """
+        return self._get_sla_rules_batch(
+            cr, uid, [doc], context=context)[doc.id]
+
+    def _resolve_sla_settings(self, cr, uid, model, doc_ids, context=None):
+        """
+        Returns the SLA Definitions and working calendar applying to a set of
+        documents of a model, as a dict {doc_id: (sla_ids, calendar_id)}.
+
+        The SLAs are the ones of the document's Contract, if it has any, or
+        else of its Project's Contract. The calendar is the Project's one.
+        Both are found with a single query, grouping the SLAs per Contract
+        so that documents under the same Contract share them.
+        """
+        res = dict((doc_id, ((), False)) for doc_id in doc_ids)
+        if not doc_ids:
+            return res
+
+        def stored(field, relation):
+            column = model._columns.get(field)
+            return (column is not None and column._type == 'many2one' and
+                    column._obj == relation and
+                    getattr(column, '_classic_write', False))
+
+        account_obj = self.pool['account.analytic.account']
+        rel, account_col, sla_col = account_obj._columns[
+            'sla_ids']._sql_names(account_obj)
+        doc_account = project_account = calendar = 'NULL::integer'
+        join = ''
+        if stored('analytic_account_id', 'account.analytic.account'):
+            doc_account = 'd.analytic_account_id'
+        if stored('project_id', 'project.project'):
+            join = 'LEFT JOIN project_project AS p ON p.id = d.project_id'
+            project_account = 'p.analytic_account_id'
+            calendar = 'p.resource_calendar_id'
+        for sub_ids in cr.split_for_in_conditions(doc_ids):
+            cr.execute("""
+                WITH docs AS (
+                    SELECT d.id,
+                           %(doc_account)s AS doc_account_id,
+                           %(project_account)s AS project_account_id,
+                           %(calendar)s AS calendar_id
+                    FROM %(table)s AS d %(join)s
+                    WHERE d.id IN %%s),
+                slas AS (
+                    SELECT r.%(account_col)s AS account_id,
+                           array_agg(r.%(sla_col)s ORDER BY r.%(sla_col)s)
+                               AS sla_ids
+                    FROM %(rel)s AS r
+                    JOIN project_sla AS s
+                        ON s.id = r.%(sla_col)s AND s.active
+                    WHERE r.%(account_col)s IN (
+                        SELECT doc_account_id FROM docs
+                        UNION SELECT project_account_id FROM docs)
+                    GROUP BY r.%(account_col)s)
+                SELECT docs.id,
+                       COALESCE(doc_slas.sla_ids, project_slas.sla_ids),
+                       docs.calendar_id
+                FROM docs
+                LEFT JOIN slas AS doc_slas
+                    ON doc_slas.account_id = docs.doc_account_id
+                LEFT JOIN slas AS project_slas
+                    ON project_slas.account_id = docs.project_account_id
+                """ % {'table': model._table, 'join': join, 'rel': rel,
+                       'doc_account': doc_account,
+                       'project_account': project_account,
+                       'calendar': calendar, 'account_col': account_col,
+                       'sla_col': sla_col},
+                (sub_ids,))
+            for doc_id, sla_ids, calendar_id in cr.fetchall():
+                res[doc_id] = (tuple(sla_ids or ()), calendar_id or False)
+        return res
+
+    def _get_sla_rules_batch(self, cr, uid, docs, resolved=None,
+                             context=None):
+        """
+        Batch version of ``_get_sla_rules``, for a list of documents of the
+        same model. Returns a dict {doc_id: [(sla, sla_line)]}
+        ``resolved`` is the result of ``_resolve_sla_settings`` for the
+        documents, computed if not given.
+
+        Rule conditions are compiled once and cached. Conditions that can
+        be translated into a domain are checked for all the documents with
+        a single search; the other ones are evaluated document by document.
+        """
+        res = dict((doc.id, []) for doc in docs)
+        if not docs:
+            return res
+        model = self.pool[docs[0]._name]
+        if resolved is None:
+            resolved = self._resolve_sla_settings(
+                cr, uid, model, list(res), context=context)
+        search_ctx = dict(context or {}, active_test=False)
+        docs_per_slas = {}
+        for doc in docs:
+            key = resolved[doc.id][0]
+            docs_per_slas.setdefault(key, []).append(doc)
+
+        sla_obj = self.pool['project.sla']
+        for sla_ids, sla_docs in docs_per_slas.items():
+            sla_ids = sla_obj.browse(cr, uid, list(sla_ids), context=context)
+            for sla in sla_ids:
+                if sla.control_model != model._name:
+                    continue  # SLA not for this model; skip
+                pending = list(sla_docs)
+                for l in sla.sla_line_ids:
+                    if not pending:
+                        break
+                    if not l.condition:
+                        matched = pending
+                    else:
+                        cond = get_condition(cr, l, model)
+                        if cond.domain is not None:
+                            domain = ([('id', 'in', [d.id for d in pending])]
+                                      + cond.domain)
+                            match_ids = set(model.search(
+                                cr, SUPERUSER_ID, domain, context=search_ctx))
+                            matched = [d for d in pending
+                                       if d.id in match_ids]
+                        else:
+                            matched = [d for d in pending
+                                       if cond.evaluate(d)]
+                    for doc in matched:
+                        res[doc.id].append((sla, l))
+                    matched_ids = set(d.id for d in matched)
+                    pending = [d for d in pending if d.id not in matched_ids]
+            for doc in sla_docs:
+                if sla_ids and not res[doc.id]:
+                    _logger.warning(
+                        "No valid SLA rule foun for %d, SLA Ids %s"
+                        % (doc.id, repr([x.id for x in sla_ids])))
+        return res
+
+    def _get_sla_values(self, doc, sla, line, start_date, warn_date,
+                        lim_date):
+        """
+        Returns the SLA Control values for a document and SLA Rule, given
+        the already computed start, warning and limit dates.
+        """
+        def datetime2str(dt_value, fmt):  # tolerant datetime to string
+            return dt_value and dt.strftime(dt_value, fmt) or None
+
+        # evaluate sla state
+        control_val = getattr(doc, sla.control_field_id.name)
+        if lim_date is None:  # paused: no dates until resumed
+            control_date = control_val and dt.strptime(control_val, DT_FMT)
+            sla_val, sla_state = control_val and (1, '1') or (0, '2')
+        elif control_val:
+            control_date = dt.strptime(control_val, DT_FMT)
+            if control_date > lim_date:
+                sla_val, sla_state = 0, '5'  # failed
+            else:
+                sla_val, sla_state = 1, '1'  # achieved
+        else:
+            control_date = None
+            now = dt.now()
+            if now > lim_date:
+                sla_val, sla_state = 0, '4'  # will fail
+            elif now > warn_date:
+                sla_val, sla_state = 0, '3'  # warning
+            else:
+                sla_val, sla_state = 0, '2'  # watching
+        return {'sla_line_id': line.id,
+                'sla_achieved': sla_val,
+                'sla_state': sla_state,
+                'sla_warn_date': datetime2str(warn_date, DT_FMT),
+                'sla_limit_date': datetime2str(lim_date, DT_FMT),
+                'sla_start_date': datetime2str(start_date, DT_FMT),
+                'sla_close_date': datetime2str(control_date, DT_FMT),
+                'doc_id': doc.id,
+                'doc_model': sla.control_model}
 
     def _get_computed_slas(self, cr, uid, doc, context=None):
         """
@@ -162,70 +459,254 @@ class SLAControl(orm.Model):
         * Creation date is used to start counting time
         * Control date, used to calculate SLA achievement, is defined in the
           SLA Definition rules.
+        * The time spent in pause stages isn't counted: see
+          ``_compute_sla_batch``.
         """
-        def datetime2str(dt_value, fmt):  # tolerant datetime to string
-            return dt_value and dt.strftime(dt_value, fmt) or None
+        return self._compute_sla_batch(cr, uid, [doc], context=context)[doc.id]
 
-        res = []
-        sla_ids = (safe_getattr(doc, 'analytic_account_id.sla_ids') or
-                   safe_getattr(doc, 'project_id.analytic_account_id.sla_ids'))
-        if not sla_ids:
+    def _get_sla_rel(self, model):
+        """
+        Returns the (table, document column, control column) names of the
+        ``sla_control_ids`` many2many relation of a controlled model.
+        """
+        return model._columns['sla_control_ids']._sql_names(model)
+
+    def _get_doc_controls(self, cr, model, doc_ids):
+        """
+        Prefetch the existing SLA Control records of a set of documents.
+        Returns a dict {doc_id: {sla_line_id: (control_id, locked, state)}}
+        """
+        res = {}
+        if not doc_ids:
             return res
+        rel, doc_col, ctrl_col = self._get_sla_rel(model)
+        cr.execute("""
+            SELECT rel.%(doc_col)s, c.id, c.sla_line_id, c.locked, c.sla_state
+            FROM %(rel)s AS rel
+            JOIN project_sla_control AS c ON c.id = rel.%(ctrl_col)s
+            WHERE rel.%(doc_col)s IN %%s
+            """ % {'rel': rel, 'doc_col': doc_col, 'ctrl_col': ctrl_col},
+            (tuple(doc_ids),))
+        for doc_id, ctrl_id, line_id, locked, state in cr.fetchall():
+            res.setdefault(doc_id, {})[line_id] = (ctrl_id, locked, state)
+        return res
 
-        for sla in sla_ids:
-            if sla.control_model != doc._name:
-                continue  # SLA not for this model; skip
-
-            for l in sla.sla_line_ids:
-                eval_context = {'o': doc, 'obj': doc, 'object': doc}
-                if not l.condition or safe_eval(l.condition, eval_context):
-                    start_date = dt.strptime(doc.create_date, DT_FMT)
-                    res_uid = doc.user_id.id or uid
-                    cal = safe_getattr(
-                        doc, 'project_id.resource_calendar_id.id')
-                    warn_date = self._compute_sla_date(
-                        cr, uid, cal, res_uid,
-                        start_date, l.warn_qty,
-                        context=context)
-                    lim_date = self._compute_sla_date(
-                        cr, uid, cal, res_uid,
-                        warn_date, l.limit_qty - l.warn_qty,
-                        context=context)
-                    # evaluate sla state
-                    control_val = getattr(doc, sla.control_field_id.name)
-                    if control_val:
-                        control_date = dt.strptime(control_val, DT_FMT)
-                        if control_date > lim_date:
-                            sla_val, sla_state = 0, '5'  # failed
-                        else:
-                            sla_val, sla_state = 1, '1'  # achieved
+    def _get_sla_anchor(self, running, hours):
+        """
+        Running segment of a document's SLA clock in which ``hours``
+        working hours are reached: the last start or resume event with less
+        consumed hours, as an (event_date, consumed_hours) pair.
+        ``running`` are the start and resume events, in chronological order.
+        """
+        anchor = running[0]
+        for event_date, consumed in running:
+            if consumed < hours:
+                anchor = (event_date, consumed)
+        return anchor
+
+    def _compute_sla_batch(self, cr, uid, docs, context=None):
+        """
+        Compute the SLA Control values for a list of documents.
+        Documents are grouped by (calendar, resource), so that identical
+        working time computations are only made once per group.
+        Returns a dict {doc_id: [sla values]}
+
+        Each date is computed from the start or resume event of the SLA
+        timeline during which its hours are reached, deducting the working
+        hours already consumed then, or from the creation date when the
+        document has no events. Dates reached before a pause, or before
+        the document was closed, are so kept as they were. While paused,
+        the warning and limit dates are cleared, unless the limit was
+        already reached.
+        """
+        groups = {}
+        if not docs:
+            return {}
+        model = self.pool[docs[0]._name]
+        doc_ids = [doc.id for doc in docs]
+        resolved = self._resolve_sla_settings(
+            cr, uid, model, doc_ids, context=context)
+        timelines = self.pool['project.sla.event'].get_timelines(
+            cr, uid, model._name, doc_ids, context=context)
+        doc_rules = self._get_sla_rules_batch(
+            cr, uid, docs, resolved=resolved, context=context)
+        for doc in docs:
+            rules = doc_rules[doc.id]
+            start_date = dt.strptime(doc.create_date, DT_FMT)
+            res_uid = doc.user_id.id or uid
+            cal = resolved[doc.id][1]
+            timeline = timelines.get(doc.id) or [
+                ('started', start_date, 0.0)]
+            running = [(date, consumed)
+                       for event, date, consumed in timeline
+                       if event in SLA_RUNNING_EVENTS] or [(start_date, 0.0)]
+            event, _date, consumed = timeline[-1]
+            groups.setdefault((cal, res_uid), []).append(
+                (doc, rules, start_date, running, consumed,
+                 event == 'paused'))
+
+        res = {}
+        cache_keys = {}
+        for (cal, res_uid), items in groups.items():
+            if cal not in cache_keys:
+                cache_keys[cal] = self._get_calendar_cache_key(
+                    cr, uid, cal, context=context)
+
+            dates = {}
+
+            def sla_date(base_date, hours):
+                if (base_date, hours) not in dates:
+                    dates[(base_date, hours)] = self._compute_sla_date(
+                        cr, uid, cal, res_uid, base_date, hours,
+                        cache_key=cache_keys[cal], context=context)
+                return dates[(base_date, hours)]
+
+            for doc, rules, start_date, running, consumed, paused in items:
+                res[doc.id] = []
+                for sla, l in rules:
+                    if paused and consumed < l.limit_qty:
+                        res[doc.id].append(self._get_sla_values(
+                            doc, sla, l, start_date, None, None))
+                        continue
+                    warn_base, warn_consumed = self._get_sla_anchor(
+                        running, l.warn_qty)
+                    warn_date = sla_date(
+                        warn_base, max(l.warn_qty - warn_consumed, 0))
+                    lim_base, lim_consumed = self._get_sla_anchor(
+                        running, l.limit_qty)
+                    if lim_base == warn_base:
+                        # Same running segment: go on from the warning date
+                        lim_date = sla_date(warn_date, max(
+                            l.limit_qty - max(l.warn_qty, lim_consumed), 0))
                     else:
-                        control_date = None
-                        now = dt.now()
-                        if now > lim_date:
-                            sla_val, sla_state = 0, '4'  # will fail
-                        elif now > warn_date:
-                            sla_val, sla_state = 0, '3'  # warning
-                        else:
-                            sla_val, sla_state = 0, '2'  # watching
-
-                    res.append(
-                        {'sla_line_id': l.id,
-                         'sla_achieved': sla_val,
-                         'sla_state': sla_state,
-                         'sla_warn_date': datetime2str(warn_date, DT_FMT),
-                         'sla_limit_date': datetime2str(lim_date, DT_FMT),
-                         'sla_start_date': datetime2str(start_date, DT_FMT),
-                         'sla_close_date': datetime2str(control_date, DT_FMT),
-                         'doc_id': doc.id,
-                         'doc_model': sla.control_model})
-                    break
-
-        if sla_ids and not res:
-            _logger.warning("No valid SLA rule foun for %d, SLA Ids %s"
-                            % (doc.id, repr([x.id for x in sla_ids])))
+                        lim_date = sla_date(
+                            lim_base, max(l.limit_qty - lim_consumed, 0))
+                    res[doc.id].append(self._get_sla_values(
+                        doc, sla, l, start_date, warn_date, lim_date))
         return res
 
+    def _write_sla_batch(self, cr, uid, model, controls, values,
+                         context=None):
+        """
+        Store computed SLA values for a chunk of documents, using one bulk
+        statement per operation instead of one ``write`` per document:
+        new SLA Controls are inserted and linked, existing unlocked ones are
+        updated, and the documents summary SLA state is set.
+        ``controls`` is the result of ``_get_doc_controls`` and ``values``
+        the one of ``_compute_sla_batch``.
+        """
+        rel, doc_col, ctrl_col = self._get_sla_rel(model)
+        inserts, updates, cleared, doc_states = [], [], [], []
+        for doc_id, sla_recs in values.items():
+            control = controls.get(doc_id, {})
+            if not sla_recs:
+                cleared.append(doc_id)
+                doc_states.append((doc_id, None))
+                continue
+            states = []
+            for sla_rec in sla_recs:
+                ctrl = control.get(sla_rec['sla_line_id'])
+                if not ctrl:
+                    inserts.append(sla_rec)
+                    states.append(sla_rec['sla_state'])
+                elif ctrl[1]:  # locked
+                    states.append(ctrl[2])
+                else:
+                    updates.append((ctrl[0], sla_rec))
+                    states.append(sla_rec['sla_state'])
+            doc_states.append((doc_id, max(states)))
+
+        if cleared:
+            cr.execute("DELETE FROM %s WHERE %s IN %%s" % (rel, doc_col),
+                       (tuple(cleared),))
+        if inserts:
+            rows = ','.join(
+                cr.mogrify(
+                    "(%s, %s, %s, %s, %s, %s, %s, %s, %s, false,"
+                    " %s, (now() at time zone 'UTC'),"
+                    " %s, (now() at time zone 'UTC'))",
+                    (r['doc_id'], r['doc_model'], r['sla_line_id'],
+                     r['sla_warn_date'], r['sla_limit_date'],
+                     r['sla_start_date'], r['sla_close_date'],
+                     r['sla_achieved'], r['sla_state'], uid, uid))
+                for r in inserts)
+            cr.execute("""
+                INSERT INTO project_sla_control (
+                    doc_id, doc_model, sla_line_id,
+                    sla_warn_date, sla_limit_date,
+                    sla_start_date, sla_close_date,
+                    sla_achieved, sla_state, locked,
+                    create_uid, create_date, write_uid, write_date)
+                VALUES %s
+                RETURNING doc_id, id""" % rows)
+            links = ','.join(cr.mogrify("(%s, %s)", row)
+                             for row in cr.fetchall())
+            cr.execute("INSERT INTO %s (%s, %s) VALUES %s"
+                       % (rel, doc_col, ctrl_col, links))
+        if updates:
+            rows = ','.join(
+                cr.mogrify(
+                    "(%s, %s::timestamp, %s::timestamp, %s::timestamp,"
+                    " %s::timestamp, %s, %s)",
+                    (ctrl_id, r['sla_warn_date'], r['sla_limit_date'],
+                     r['sla_start_date'], r['sla_close_date'],
+                     r['sla_achieved'], r['sla_state']))
+                for ctrl_id, r in updates)
+            cr.execute("""
+                UPDATE project_sla_control AS c SET
+                    sla_warn_date = v.sla_warn_date,
+                    sla_limit_date = v.sla_limit_date,
+                    sla_start_date = v.sla_start_date,
+                    sla_close_date = v.sla_close_date,
+                    sla_achieved = v.sla_achieved,
+                    sla_state = v.sla_state,
+                    write_uid = %%s,
+                    write_date = (now() at time zone 'UTC')
+                FROM (VALUES %s) AS v(
+                    id, sla_warn_date, sla_limit_date, sla_start_date,
+                    sla_close_date, sla_achieved, sla_state)
+                WHERE c.id = v.id""" % rows, (uid,))
+        if doc_states:
+            rows = ','.join(cr.mogrify("(%s, %s::varchar)", row)
+                            for row in doc_states)
+            cr.execute("""
+                UPDATE %s AS d SET sla_state = v.sla_state
+                FROM (VALUES %s) AS v(id, sla_state)
+                WHERE d.id = v.id""" % (model._table, rows))
+        return True
+
+    def _store_sla_control_batch(self, cr, uid, model_name, doc_ids,
+                                 context=None):
+        """
+        Set-based SLA calculation and storage for many documents of a model.
+        Documents are processed in chunks of ``SLA_CHUNK_SIZE``: for each
+        chunk the documents, their SLA Controls, SLA Rules, calendars and
+        users are prefetched at once, and the results are stored with one
+        bulk statement per operation.
+        """
+        model = self.pool[model_name]
+        total, started = 0, time.time()
+        for i in range(0, len(doc_ids), SLA_CHUNK_SIZE):
+            chunk = doc_ids[i:i + SLA_CHUNK_SIZE]
+            chunk_started = time.time()
+            docs = model.browse(cr, uid, chunk, context=context)
+            controls = self._get_doc_controls(cr, model, chunk)
+            values = self._compute_sla_batch(cr, uid, docs, context=context)
+            self._write_sla_batch(
+                cr, SUPERUSER_ID, model, controls, values, context=context)
+            total += len(chunk)
+            elapsed = time.time() - chunk_started
+            _logger.info(
+                '...%d SLAs recomputed for %s (%.2fs per 1000 documents, '
+                'calendar cache: %s)', total, model_name,
+                elapsed * 1000.0 / len(chunk), cache_stats())
+        if total > SLA_CHUNK_SIZE:
+            _logger.info(
+                '%d SLAs recomputed for %s in %.2fs', total, model_name,
+                time.time() - started)
+        self.invalidate_cache(cr, uid, context=context)
+        return True
+
     def store_sla_control(self, cr, uid, docs, context=None):
         """
         Used by controlled documents to ask for SLA calculation and storage.
@@ -240,31 +721,12 @@ class SLAControl(orm.Model):
             ctx['__sla_stored__'] = 1
 
         res = []
-        for ix, doc in enumerate(docs):
-            if ix and ix % 50 == 0:
-                _logger.info('...%d SLAs recomputed for %s' % (ix, doc._name))
-            control = {x.sla_line_id.id: x
-                       for x in doc.sla_control_ids}
-            sla_recs = self._get_computed_slas(cr, uid, doc, context=ctx)
-            # calc sla control lines
-            if sla_recs:
-                slas = []
-                for sla_rec in sla_recs:
-                    sla_line_id = sla_rec.get('sla_line_id')
-                    if sla_line_id in control:
-                        control_rec = control.get(sla_line_id)
-                        if not control_rec.locked:
-                            slas += m2m.write(control_rec.id, sla_rec)
-                    else:
-                        slas += m2m.add(sla_rec)
-                global_sla = max([sla[2].get('sla_state') for sla in slas])
-            else:
-                slas = m2m.clear()
-                global_sla = None
-            # calc sla control summary and store
-            vals = {'sla_state': global_sla, 'sla_control_ids': slas}
-            doc._model.write(  # regular users can't write on SLA Control
-                cr, SUPERUSER_ID, [doc.id], vals, context=ctx)
+        doc_ids = {}
+        for doc in docs:
+            doc_ids.setdefault(doc._name, []).append(doc.id)
+        for model_name, ids in doc_ids.items():
+            self._store_sla_control_batch(
+                cr, uid, model_name, ids, context=ctx)
         return res
 
 
@@ -274,32 +736,182 @@ class SLAControlled(orm.AbstractModel):
     """
     _name = 'project.sla.controlled'
     _description = 'SLA Controlled Document'
+
+    def _get_sla_event_ids(self, cr, uid, ids, name, arg, context=None):
+        """ SLA timeline events of the documents, in chronological order """
+        res = dict((x, []) for x in ids)
+        for sub_ids in cr.split_for_in_conditions(ids):
+            cr.execute("""
+                SELECT doc_id, id FROM project_sla_event
+                WHERE doc_model = %s AND doc_id IN %s
+                ORDER BY event_date, id
+                """, (self._name, sub_ids))
+            for doc_id, event_id in cr.fetchall():
+                res[doc_id].append(event_id)
+        return res
+
     _columns = {
         'sla_control_ids': fields.many2many(
             'project.sla.control', string="SLA Control", ondelete='cascade'),
         'sla_state': fields.selection(
             SLA_STATES, string="SLA Status", readonly=True),
+        'sla_event_ids': fields.function(
+            _get_sla_event_ids, type='one2many', relation='project.sla.event',
+            string="SLA Timeline"),
         }
 
+    _sla_depends_cache = {}
+
+    def _get_sla_depends(self, cr, uid, context=None):
+        """
+        Returns the set of document fields the SLAs of this model depend on:
+        the SLA Definitions control date fields, the fields used in their
+        Rule conditions, and ``SLA_DEPENDS``.
+        The result is cached until a SLA Definition or Rule for this model
+        is changed.
+        """
+        cr.execute("""
+            SELECT max(s.write_date), max(l.write_date),
+                   count(DISTINCT s.id), count(l.id)
+            FROM project_sla AS s
+            LEFT JOIN project_sla_line AS l ON l.sla_id = s.id
+            WHERE s.control_model = %s
+            """, (self._name,))
+        signature = cr.fetchone()
+        key = (cr.dbname, self._name)
+        cached = self._sla_depends_cache.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+        depends = set(SLA_DEPENDS)
+        sla_obj = self.pool['project.sla']
+        ctx = dict(context or {}, active_test=False)
+        sla_ids = sla_obj.search(
+            cr, SUPERUSER_ID, [('control_model', '=', self._name)],
+            context=ctx)
+        for sla in sla_obj.browse(cr, SUPERUSER_ID, sla_ids, context=ctx):
+            depends.add(sla.control_field_id.name)
+            for line in sla.sla_line_ids:
+                if line.condition:
+                    depends |= condition_fields(line.condition)
+        depends = frozenset(depends)
+        self._sla_depends_cache[key] = (signature, depends)
+        return depends
+
+    def _store_sla(self, cr, uid, docs, context=None):
+        """
+        Recompute the SLAs of the documents, or queue them for later
+        recomputation when the deferred mode is enabled.
+        """
+        if '__sla_stored__' in (context or {}):
+            return False
+        queue_obj = self.pool['project.sla.queue']
+        if queue_obj.is_deferred(cr, uid, context=context):
+            return queue_obj.enqueue(
+                cr, uid, self._name, [x.id for x in docs], context=context)
+        return self.pool.get('project.sla.control').store_sla_control(
+            cr, uid, docs, context=context)
+
+    def _get_sla_clock_event(self, doc):
+        """
+        Returns the SLA clock event matching the document's stage: "closed"
+        for folded stages, "paused" for pause stages, or else "resumed".
+        """
+        stage = 'stage_id' in self._columns and doc.stage_id
+        if stage and stage.fold:
+            return 'closed'
+        if stage and stage.sla_pause:
+            return 'paused'
+        return 'resumed'
+
+    def _log_sla_events(self, cr, uid, docs, context=None):
+        """
+        Log the SLA clock events of the documents whose stage changed the
+        clock state, with the working hours consumed up to now.
+        Returns the ids of the documents with a new event.
+        """
+        if not docs:
+            return []
+        ctrl_obj = self.pool['project.sla.control']
+        event_obj = self.pool['project.sla.event']
+        doc_ids = [x.id for x in docs]
+        last_events = event_obj.get_last_events(
+            cr, uid, self._name, doc_ids, context=context)
+        resolved = ctrl_obj._resolve_sla_settings(
+            cr, uid, self, doc_ids, context=context)
+        now = dt.now().replace(microsecond=0)
+        events = []
+        for doc in docs:
+            event = self._get_sla_clock_event(doc)
+            last, last_date, consumed = last_events.get(
+                doc.id, ('started', dt.strptime(doc.create_date, DT_FMT), 0.0))
+            running = last in SLA_RUNNING_EVENTS
+            if event == last or (event == 'resumed' and running):
+                continue  # clock state unchanged
+            if running:
+                consumed += ctrl_obj._compute_consumed_hours(
+                    cr, uid, resolved[doc.id][1], doc.user_id.id or uid,
+                    last_date, now, context=context)
+            events.append((doc.id, event, now, consumed))
+        event_obj.log_events(cr, uid, self._name, events, context=context)
+        return [x[0] for x in events]
+
     def create(self, cr, uid, vals, context=None):
         res = super(SLAControlled, self).create(cr, uid, vals, context=context)
         docs = self.browse(cr, uid, [res], context=context)
-        self.pool.get('project.sla.control').store_sla_control(
-            cr, uid, docs, context=context)
+        # Start the SLA clock, paused or closed if created in such a stage
+        events = [(res, 'started', docs[0].create_date, 0.0)]
+        event = self._get_sla_clock_event(docs[0])
+        if event != 'resumed':
+            events.append((res, event, docs[0].create_date, 0.0))
+        self.pool['project.sla.event'].log_events(
+            cr, uid, self._name, events, context=context)
+        self._store_sla(cr, uid, docs, context=context)
         return res
 
     def write(self, cr, uid, ids, vals, context=None):
         res = super(SLAControlled, self).write(
             cr, uid, ids, vals, context=context)
+        if '__sla_stored__' in (context or {}):
+            return res
+        clock_ids = []
+        if 'stage_id' in vals:
+            clock_ids = self._log_sla_events(
+                cr, uid, self.browse(cr, uid, ids, context=context),
+                context=context)
+        if not (clock_ids or
+                set(vals) & self._get_sla_depends(cr, uid, context=context)):
+            return res  # no SLA relevant field changed
         docs = [x for x in self.browse(cr, uid, ids, context=context)
-                if (not x.stage_id.fold or x.sla_state not in ['1', '5'])]
-        self.pool.get('project.sla.control').store_sla_control(
-            cr, uid, docs, context=context)
+                if (x.id in clock_ids or not x.stage_id.fold or
+                    x.sla_state not in ['1', '5'])]
+        self._store_sla(cr, uid, docs, context=context)
         return res
 
     def unlink(self, cr, uid, ids, context=None):
-        # Unlink and delete all related Control records
-        for doc in self.browse(cr, uid, ids, context=context):
-            vals = [m2m.remove(x.id)[0] for x in doc.sla_control_ids]
-            doc.write({'sla_control_ids': vals})
+        # Unlink and delete all related Control records, with one statement
+        # per batch of documents, keeping their ids for the SLA report
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ctrl_obj = self.pool['project.sla.control']
+        rel, doc_col, ctrl_col = ctrl_obj._get_sla_rel(self)
+        for sub_ids in cr.split_for_in_conditions(ids):
+            cr.execute("""
+                WITH links AS (
+                    DELETE FROM %(rel)s WHERE %(doc_col)s IN %%s
+                    RETURNING %(ctrl_col)s AS control_id),
+                controls AS (
+                    DELETE FROM project_sla_control
+                    WHERE id IN (SELECT control_id FROM links)
+                    RETURNING id)
+                INSERT INTO project_sla_control_deleted (control_id)
+                SELECT id FROM controls
+                """ % {'rel': rel, 'doc_col': doc_col, 'ctrl_col': ctrl_col},
+                (sub_ids,))
+            cr.execute("DELETE FROM project_sla_queue "
+                       "WHERE doc_model = %s AND doc_id IN %s",
+                       (self._name, sub_ids))
+            cr.execute("DELETE FROM project_sla_event "
+                       "WHERE doc_model = %s AND doc_id IN %s",
+                       (self._name, sub_ids))
+        ctrl_obj.invalidate_cache(cr, uid, context=context)
         return super(SLAControlled, self).unlink(cr, uid, ids, context=context)
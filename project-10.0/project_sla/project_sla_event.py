@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import fields, orm
+from openerp.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT as DT_FMT
+from datetime import datetime as dt
+
+SLA_EVENTS = [
+    ('started', 'Started'),
+    ('paused', 'Paused'),
+    ('resumed', 'Resumed'),
+    ('closed', 'Closed'),
+    ]
+
+# Events after which the SLA clock is running
+SLA_RUNNING_EVENTS = ('started', 'resumed')
+
+
+class SLAEvent(orm.Model):
+    """
+    SLA Timeline Events
+    Append-only log of the events of the SLA clock of controlled documents:
+    started on creation, paused and resumed when moving to and from a pause
+    stage, and closed when moving to a folded stage.
+    Each event stores the working hours consumed so far, so that SLA dates
+    can be computed from the last event instead of the creation date.
+    """
+    _name = 'project.sla.event'
+    _description = 'SLA Timeline Event'
+    _log_access = False
+    _order = 'doc_model, doc_id, event_date, id'
+
+    _columns = {
+        'doc_id': fields.integer('Document ID', required=True, readonly=True),
+        'doc_model': fields.char(
+            'Document Model', size=128, required=True, readonly=True),
+        'event': fields.selection(
+            SLA_EVENTS, 'Event', required=True, readonly=True),
+        'event_date': fields.datetime('Date', required=True, readonly=True),
+        'consumed_hours': fields.float(
+            'Consumed Hours', readonly=True,
+            help="Working hours the SLA clock ran, up to this event"),
+        }
+
+    def _auto_init(self, cr, context=None):
+        res = super(SLAEvent, self)._auto_init(cr, context=context)
+        index = 'project_sla_event_doc_date_index'
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s",
+                   (index,))
+        if not cr.fetchone():
+            cr.execute("CREATE INDEX %s ON project_sla_event "
+                       "(doc_model, doc_id, event_date)" % index)
+        return res
+
+    def get_last_events(self, cr, uid, doc_model, doc_ids, context=None):
+        """
+        Returns the last event of each document, as a dict
+        {doc_id: (event, event_date, consumed_hours)}, with a datetime
+        event date. Documents without events are not included.
+        """
+        res = {}
+        for sub_ids in cr.split_for_in_conditions(doc_ids):
+            cr.execute("""
+                SELECT DISTINCT ON (doc_id)
+                       doc_id, event, event_date, consumed_hours
+                FROM project_sla_event
+                WHERE doc_model = %s AND doc_id IN %s
+                ORDER BY doc_id, event_date DESC, id DESC
+                """, (doc_model, sub_ids))
+            for doc_id, event, event_date, consumed in cr.fetchall():
+                if not isinstance(event_date, dt):
+                    event_date = dt.strptime(event_date, DT_FMT)
+                res[doc_id] = (event, event_date, consumed or 0.0)
+        return res
+
+    def get_timelines(self, cr, uid, doc_model, doc_ids, context=None):
+        """
+        Returns the events of each document in chronological order, as a
+        dict {doc_id: [(event, event_date, consumed_hours)]}, with datetime
+        event dates. Documents without events are not included.
+        """
+        res = {}
+        for sub_ids in cr.split_for_in_conditions(doc_ids):
+            cr.execute("""
+                SELECT doc_id, event, event_date, consumed_hours
+                FROM project_sla_event
+                WHERE doc_model = %s AND doc_id IN %s
+                ORDER BY doc_id, event_date, id
+                """, (doc_model, sub_ids))
+            for doc_id, event, event_date, consumed in cr.fetchall():
+                if not isinstance(event_date, dt):
+                    event_date = dt.strptime(event_date, DT_FMT)
+                res.setdefault(doc_id, []).append(
+                    (event, event_date, consumed or 0.0))
+        return res
+
+    def log_events(self, cr, uid, doc_model, events, context=None):
+        """
+        Append events to the log, with a single statement.
+        ``events`` is a list of (doc_id, event, event_date, consumed_hours)
+        """
+        if not events:
+            return True
+        rows = ','.join(
+            cr.mogrify("(%s, %s, %s, %s, %s)", (
+                doc_model, doc_id, event,
+                isinstance(date, dt) and date.strftime(DT_FMT) or date,
+                consumed))
+            for doc_id, event, date, consumed in events)
+        cr.execute("""
+            INSERT INTO project_sla_event (
+                doc_model, doc_id, event, event_date, consumed_hours)
+            VALUES %s""" % rows)
+        return True
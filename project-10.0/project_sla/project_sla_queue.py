@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import psycopg2
+
+from openerp.osv import fields, orm
+from openerp import SUPERUSER_ID
+
+from .project_sla_control import SLA_CHUNK_SIZE
+
+import logging
+_logger = logging.getLogger(__name__)
+
+# System parameter enabling the deferred SLA recomputation mode
+SLA_DEFERRED_PARAM = 'project_sla.deferred'
+# First PostgreSQL version with INSERT ... ON CONFLICT and SKIP LOCKED
+PG_SKIP_LOCKED_VERSION = 90500
+
+
+def _pg_skip_locked(cr):
+    """ Tells if the database server supports ON CONFLICT and SKIP LOCKED """
+    return cr._cnx.server_version >= PG_SKIP_LOCKED_VERSION
+
+
+class SLAQueue(orm.Model):
+    """
+    SLA Recomputation Queue
+    When the deferred mode is enabled, controlled documents created or
+    modified are queued here, instead of having their SLAs recomputed
+    right away. A scheduled job then recomputes them in batches.
+    A document is queued only once, no matter how many times it is
+    modified before being processed.
+    The queue relies on PostgreSQL 9.5 ON CONFLICT and SKIP LOCKED; older
+    servers use slower statements, and workers draining the queue wait
+    for each other instead of skipping the rows locked by the others.
+    """
+    _name = 'project.sla.queue'
+    _description = 'SLA Recomputation Queue'
+    _log_access = False
+    _order = 'id'
+
+    _columns = {
+        'doc_id': fields.integer('Document ID', required=True, readonly=True),
+        'doc_model': fields.char(
+            'Document Model', size=128, required=True, readonly=True),
+        'queue_date': fields.datetime('Queued On', readonly=True),
+        }
+    _sql_constraints = [
+        ('doc_uniq', 'unique(doc_model, doc_id)',
+         'A document can be queued only once.'),
+        ]
+
+    def is_deferred(self, cr, uid, context=None):
+        """
+        Tells if SLA recomputation is deferred: the ``sla_deferred``
+        context key has precedence over the ``project_sla.deferred``
+        system parameter.
+        """
+        context = context or {}
+        if 'sla_deferred' in context:
+            return bool(context['sla_deferred'])
+        param = self.pool['ir.config_parameter'].get_param(
+            cr, SUPERUSER_ID, SLA_DEFERRED_PARAM)
+        return param not in (False, None, '', '0', 'False')
+
+    def enqueue(self, cr, uid, doc_model, doc_ids, context=None):
+        """ Queue documents for SLA recomputation, ignoring queued ones """
+        if not doc_ids:
+            return True
+        if _pg_skip_locked(cr):
+            cr.execute("""
+                INSERT INTO project_sla_queue (doc_model, doc_id, queue_date)
+                SELECT %s, unnest(%s), (now() at time zone 'UTC')
+                ON CONFLICT (doc_model, doc_id) DO NOTHING
+                """, (doc_model, list(doc_ids)))
+            return True
+        while True:
+            # Retried when another transaction queued the same documents
+            # meanwhile: they are then visible to the next statement
+            try:
+                with cr.savepoint():
+                    cr.execute("""
+                        INSERT INTO project_sla_queue
+                            (doc_model, doc_id, queue_date)
+                        SELECT %(model)s, d.id, (now() at time zone 'UTC')
+                        FROM (SELECT DISTINCT unnest(%(ids)s) AS id) AS d
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM project_sla_queue q
+                            WHERE q.doc_model = %(model)s
+                              AND q.doc_id = d.id)
+                        """, {'model': doc_model, 'ids': list(doc_ids)})
+                return True
+            except psycopg2.IntegrityError:
+                continue
+
+    def _dequeue(self, cr, limit):
+        """
+        Remove and return up to ``limit`` queued documents, as a dict
+        {doc_model: [doc_ids]}. Entries locked by another worker draining
+        the queue are skipped, or waited for before PostgreSQL 9.5.
+        """
+        cr.execute("""
+            DELETE FROM project_sla_queue
+            WHERE id IN (
+                SELECT id FROM project_sla_queue
+                ORDER BY id
+                LIMIT %%s
+                FOR UPDATE%s)
+            RETURNING doc_model, doc_id
+            """ % (' SKIP LOCKED' if _pg_skip_locked(cr) else ''), (limit,))
+        res = {}
+        for doc_model, doc_id in cr.fetchall():
+            res.setdefault(doc_model, []).append(doc_id)
+        return res
+
+    def process_queue(self, cr, uid, limit=None, auto_commit=False,
+                      context=None):
+        """
+        Recompute the SLAs of queued documents, in batches of
+        ``SLA_CHUNK_SIZE`` documents, until the queue is empty or ``limit``
+        documents were processed.
+        ``auto_commit`` commits after each batch, to be used by the
+        scheduled job.
+        """
+        ctrl_obj = self.pool['project.sla.control']
+        ctx = dict(context or {}, __sla_stored__=1)
+        done = 0
+        while limit is None or done < limit:
+            size = SLA_CHUNK_SIZE
+            if limit is not None:
+                size = min(size, limit - done)
+            queued = self._dequeue(cr, size)
+            if not queued:
+                break
+            for doc_model, doc_ids in queued.items():
+                done += len(doc_ids)
+                model = self.pool.get(doc_model)
+                if model is None:
+                    continue
+                doc_ids = model.exists(cr, SUPERUSER_ID, doc_ids)
+                if doc_ids:
+                    ctrl_obj._store_sla_control_batch(
+                        cr, uid, doc_model, sorted(doc_ids), context=ctx)
+            if auto_commit:
+                cr.commit()
+        if done:
+            _logger.info('%d queued documents had their SLA recomputed', done)
+        return True
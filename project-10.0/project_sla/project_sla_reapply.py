@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import psycopg2
+
+from openerp.osv import fields, orm
+from openerp.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT as DT_FMT
+from openerp import SUPERUSER_ID
+from datetime import datetime as dt
+
+from .project_sla_control import SLA_CHUNK_SIZE
+
+import logging
+_logger = logging.getLogger(__name__)
+
+# System parameter with the number of parallel jobs of a chunked reapply
+SLA_REAPPLY_WORKERS_PARAM = 'project_sla.reapply_workers'
+
+
+class SLAReapplyJob(orm.Model):
+    """
+    SLA Reapply Job
+    A partition of the documents of a large SLA reapply, processed in
+    chunks committed one at a time. The last processed document is kept as
+    a checkpoint, so that an interrupted job can be resumed where it
+    stopped.
+    Each job is run by a one-time scheduled action: with several cron
+    workers, the partitions of a reapply are processed in parallel, each
+    by its own process and database cursor. A job row is locked while one
+    of its chunks is processed, so that a job is never run twice at once.
+    """
+    _name = 'project.sla.reapply.job'
+    _description = 'SLA Reapply Job'
+    _order = 'id desc'
+
+    _columns = {
+        'name': fields.char('Description', readonly=True),
+        'doc_model': fields.char('Document Model', size=128, readonly=True),
+        'doc_ids': fields.text('Document IDs', readonly=True),
+        'total_count': fields.integer('Documents', readonly=True),
+        'done_count': fields.integer('Processed Documents', readonly=True),
+        'last_doc_id': fields.integer(
+            'Checkpoint', readonly=True,
+            help="Last processed document ID. Documents are processed in "
+                 "ID order."),
+        'state': fields.selection(
+            [('pending', 'Pending'), ('running', 'Running'),
+             ('done', 'Done')], 'Status', readonly=True),
+        'cron_id': fields.many2one(
+            'ir.cron', 'Scheduled Action', readonly=True,
+            ondelete='set null'),
+        }
+    _defaults = {
+        'state': 'pending',
+        'done_count': 0,
+        'last_doc_id': 0,
+        }
+
+    def create_jobs(self, cr, uid, doc_model, doc_ids, workers=1,
+                    name=None, context=None):
+        """
+        Split the documents into ``workers`` partitions, each one processed
+        by a job scheduled to run right away. Returns the job ids.
+        """
+        doc_ids = sorted(set(doc_ids))
+        workers = max(1, min(workers, len(doc_ids)))
+        size = -(-len(doc_ids) // workers)  # ceiling division
+        res = []
+        for i in range(0, len(doc_ids), size):
+            part = doc_ids[i:i + size]
+            job_id = self.create(cr, uid, {
+                'name': name or 'Reapply SLAs',
+                'doc_model': doc_model,
+                'doc_ids': ','.join(str(x) for x in part),
+                'total_count': len(part),
+                }, context=context)
+            res.append(job_id)
+        self.schedule_jobs(cr, uid, res, context=context)
+        return res
+
+    def schedule_jobs(self, cr, uid, ids, context=None):
+        """ Create a one-time scheduled action running each job """
+        cron_obj = self.pool['ir.cron']
+        now = dt.strftime(dt.now(), DT_FMT)
+        for job in self.browse(cr, uid, ids, context=context):
+            if job.state == 'done':
+                continue
+            cron_id = cron_obj.create(cr, SUPERUSER_ID, {
+                'name': '%s (%s, job %d)' % (job.name, job.doc_model, job.id),
+                'user_id': uid,
+                'interval_number': 1,
+                'interval_type': 'minutes',
+                'numbercall': 1,
+                'nextcall': now,
+                'doall': True,
+                'model': self._name,
+                'function': 'run_job',
+                'args': repr((job.id,)),
+                }, context=context)
+            job.write({'cron_id': cron_id})
+        return True
+
+    def get_workers(self, cr, uid, context=None):
+        """
+        Number of jobs a chunked reapply is split into, from the
+        ``project_sla.reapply_workers`` system parameter
+        """
+        param = self.pool['ir.config_parameter'].get_param(
+            cr, SUPERUSER_ID, SLA_REAPPLY_WORKERS_PARAM)
+        try:
+            return max(1, int(param or 1))
+        except ValueError:
+            return 1
+
+    def resume(self, cr, uid, ids, context=None):
+        """ Resume interrupted jobs button action """
+        return self.schedule_jobs(cr, uid, ids, context=context)
+
+    def _lock_job(self, cr, job_id):
+        """
+        Lock the job row until the end of the transaction. Returns False
+        when it is already locked, by another process running the job.
+        """
+        try:
+            with cr.savepoint():
+                cr.execute("SELECT id FROM project_sla_reapply_job "
+                           "WHERE id = %s FOR UPDATE NOWAIT", (job_id,))
+        except psycopg2.OperationalError:
+            return False
+        return True
+
+    def run_job(self, cr, uid, job_id, context=None):
+        """
+        Reapply the SLAs of a job's documents not processed yet, committing
+        after each chunk of ``SLA_CHUNK_SIZE`` documents.
+        Does nothing when the job is being run by another process.
+        """
+        ctrl_obj = self.pool['project.sla.control']
+        if not self._lock_job(cr, job_id):
+            _logger.info('SLA reapply job %d is already running', job_id)
+            return True
+        job = self.browse(cr, uid, job_id, context=context)
+        if job.state == 'done':
+            return True
+        model = self.pool[job.doc_model]
+        doc_ids = [int(x) for x in job.doc_ids.split(',')
+                   if int(x) > job.last_doc_id]
+        done = job.done_count
+        self.write(cr, uid, [job.id], {'state': 'running'}, context=context)
+        ctx = dict(context or {}, __sla_stored__=1)
+        try:
+            for i in range(0, len(doc_ids), SLA_CHUNK_SIZE):
+                chunk = model.exists(
+                    cr, SUPERUSER_ID, doc_ids[i:i + SLA_CHUNK_SIZE])
+                if chunk:
+                    ctrl_obj._store_sla_control_batch(
+                        cr, uid, job.doc_model, sorted(chunk), context=ctx)
+                done += len(doc_ids[i:i + SLA_CHUNK_SIZE])
+                self.write(cr, uid, [job.id], {
+                    'last_doc_id': doc_ids[i:i + SLA_CHUNK_SIZE][-1],
+                    'done_count': done,
+                    }, context=context)
+                cr.commit()
+                _logger.info('SLA reapply job %d: %d/%d documents processed',
+                             job.id, done, job.total_count)
+                if not self._lock_job(cr, job.id):
+                    # Resumed meanwhile, the other run goes on from the
+                    # checkpoint just committed
+                    return True
+        except Exception:
+            # Keep the checkpoint, and let the job be resumed
+            cr.rollback()
+            self.write(cr, uid, [job.id], {'state': 'pending'},
+                       context=context)
+            cr.commit()
+            raise
+        self.write(cr, uid, [job.id], {'state': 'done'}, context=context)
+        return True
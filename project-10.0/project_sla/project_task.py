@@ -18,9 +18,19 @@
 #
 ##############################################################################
 
-from openerp.osv import orm
+from openerp.osv import fields, orm
 
 
 class ProjectTask(orm.Model):
     _name = 'project.task'
     _inherit = ['project.task', 'project.sla.controlled']
+
+
+class ProjectTaskType(orm.Model):
+    _inherit = 'project.task.type'
+    _columns = {
+        'sla_pause': fields.boolean(
+            'Pause SLA',
+            help="The SLA clock of documents in this stage is stopped, "
+                 "for example while waiting for the customer"),
+        }
@@ -1,8 +1,14 @@
+from openerp import SUPERUSER_ID
 from openerp import tools
 from openerp.osv import fields, orm
 
 from ..project_sla_control import SLA_STATES
 
+# System parameter holding the date of the last materialized report refresh
+REFRESH_PARAM = 'project_sla.report_refresh_date'
+# Time taken back from the last refresh date on incremental refreshes
+REFRESH_OVERLAP = '15 minutes'
+
 
 class report_sla(orm.Model):
     _name = "project.sla.report"
@@ -11,25 +17,6 @@ class report_sla(orm.Model):
     _order = ('date_year, date_quarter, date_month, date_week, sla_closed, '
               'sla_state')
 
-    # Overridden to automaticaly calculate correct achieved percent for any
-    # group result
-    def read_group(self, cr, uid, *args, **kwargs):
-        res = super(report_sla, self).read_group(cr, uid, *args, **kwargs)
-        for gres in res:
-            if 'achieved_count' in gres and 'total_count' in gres:
-                acount = float(gres['achieved_count'])
-                tcount = float(gres['total_count'])
-                gres['achieved_perc'] = round((acount / tcount) * 100, 2)
-        return res
-
-    def _get_achieved_percent(self, cr, uid, ids, field, arg, context=None):
-        res = {}.fromkeys(ids, 0.0)
-        for line in self.browse(cr, uid, ids, context=context):
-            acount = float(line.achieved_count)
-            tcount = float(line.total_count)
-            res[line.id] = round((acount / tcount) * 100, 2)
-        return res
-
     _columns = {
         'document_model_id': fields.many2one('ir.model', 'Document Model'),
         'sla_name': fields.char('SLA Name'),
@@ -43,17 +30,17 @@ class report_sla(orm.Model):
         'total_count': fields.integer('Total Count'),
         'achieved_count': fields.integer('Achieved Count'),
         'failed_count': fields.integer('Failed Count'),
-        'achieved_perc': fields.function(_get_achieved_percent,
-                                         string='Achieved Percent',
-                                         type='float',
-                                         readonly=True),
+        # Percentages are 0 or 100 per row, so that their average, computed
+        # by the aggregation query, is the percentage for any group
+        'achieved_perc': fields.float('Achieved Percent', digits=(16, 2),
+                                      group_operator='avg', readonly=True),
+        'failed_perc': fields.float('Failed Percent', digits=(16, 2),
+                                    group_operator='avg', readonly=True),
     }
 
-    def init(self, cr):
-        report_name = self._name.replace('.', '_')
-        tools.drop_view_if_exists(cr, report_name)
-        sql = """
-            CREATE OR REPLACE VIEW %(report_name)s AS (
+    def _select_sql(self, where=''):
+        """ Returns the report query, optionally filtered on ``where`` """
+        return """
                 SELECT
                     psc.id                               AS id,
                     im.id                                AS document_model_id,
@@ -79,7 +66,15 @@ class report_sla(orm.Model):
                                 IS NOT NULL
                         THEN True
                         ELSE False
-                    END                                  AS sla_closed
+                    END                                  AS sla_closed,
+                    CASE WHEN psc.sla_state = '1'
+                        THEN 100.0
+                        ELSE 0.0
+                    END                                  AS achieved_perc,
+                    CASE WHEN psc.sla_state IN ('4', '5')
+                        THEN 100.0
+                        ELSE 0.0
+                    END                                  AS failed_perc
                 FROM project_sla_control   AS psc
                 LEFT JOIN project_sla_line AS psl
                                             ON psl.id = psc.sla_line_id
@@ -87,6 +82,117 @@ class report_sla(orm.Model):
                                             ON ps.id  = psl.sla_id
                 LEFT JOIN ir_model         AS im
                                             ON im.model = ps.control_model
-            )
-        """ % {'report_name': report_name}
+                %(where)s
+        """ % {'where': where}
+
+    def init(self, cr):
+        report_name = self._name.replace('.', '_')
+        tools.drop_view_if_exists(cr, report_name)
+        sql = """
+            CREATE OR REPLACE VIEW %(report_name)s AS (%(select)s)
+        """ % {'report_name': report_name, 'select': self._select_sql()}
         cr.execute(sql)
+
+
+class report_sla_materialized(orm.Model):
+    """
+    Materialized variant of the SLA report, for large SLA Control volumes.
+    Rows are stored in a table, with the date buckets already computed,
+    and refreshed incrementally from the SLA Controls changed since the
+    previous refresh. The ids of deleted SLA Controls are kept in the
+    ``project_sla_control_deleted`` table until then.
+    """
+    _name = "project.sla.report.materialized"
+    _inherit = "project.sla.report"
+    _description = "Project SLA report (materialized)"
+    _auto = False
+
+    def init(self, cr):
+        table = self._table
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS %(table)s (
+                id                integer PRIMARY KEY,
+                document_model_id integer,
+                sla_name          varchar,
+                sla_line_name     varchar,
+                sla_state         varchar,
+                date_year         text,
+                date_quarter      text,
+                date_month        text,
+                date_week         text,
+                total_count       integer,
+                achieved_count    integer,
+                failed_count      integer,
+                sla_closed        boolean,
+                achieved_perc     numeric,
+                failed_perc       numeric
+            )""" % {'table': table})
+        for column in ('achieved_perc', 'failed_perc'):
+            cr.execute("SELECT 1 FROM information_schema.columns "
+                       "WHERE table_name = %s AND column_name = %s",
+                       (table, column))
+            if not cr.fetchone():
+                # Added after the table was created: rebuild it on refresh
+                cr.execute("ALTER TABLE %s ADD COLUMN %s numeric"
+                           % (table, column))
+                cr.execute("DELETE FROM ir_config_parameter WHERE key = %s",
+                           (REFRESH_PARAM,))
+        for field in ('date_year', 'date_quarter', 'date_month'):
+            index = '%s_%s_index' % (table, field)
+            cr.execute("SELECT indexname FROM pg_indexes "
+                       "WHERE indexname = %s", (index,))
+            if not cr.fetchone():
+                cr.execute("CREATE INDEX %s ON %s (%s)"
+                           % (index, table, field))
+
+    def refresh(self, cr, uid, full=False, context=None):
+        """
+        Refresh the report rows from the SLA Controls, or from their SLA
+        Definitions and Rules, changed since the previous refresh.
+        The previous refresh date is kept in the
+        ``project_sla.report_refresh_date`` system parameter; a
+        ``REFRESH_OVERLAP`` is taken back from it, to also catch changes
+        committed by transactions still running at that time.
+        ``full`` rebuilds the whole report.
+        """
+        param_obj = self.pool['ir.config_parameter']
+        table = self._table
+        cr.execute("SELECT (now() at time zone 'UTC') - %s::interval",
+                   (REFRESH_OVERLAP,))
+        refresh_date = cr.fetchone()[0]
+        since = not full and param_obj.get_param(
+            cr, SUPERUSER_ID, REFRESH_PARAM)
+        if not since:
+            # Before reading the SLA Controls: ids deleted meanwhile are
+            # kept for the next refresh
+            cr.execute("DELETE FROM project_sla_control_deleted")
+            cr.execute("TRUNCATE %s" % table)
+            cr.execute("INSERT INTO %s %s" % (table, self._select_sql()))
+        else:
+            changed = """
+                WHERE psc.id IN (
+                    SELECT c.id FROM project_sla_control AS c
+                    WHERE c.write_date >= %(since)s
+                    UNION
+                    SELECT c.id FROM project_sla_control AS c
+                    JOIN project_sla_line AS l ON l.id = c.sla_line_id
+                    JOIN project_sla AS s ON s.id = l.sla_id
+                    WHERE l.write_date >= %(since)s
+                       OR s.write_date >= %(since)s)
+                """
+            cr.execute("DELETE FROM %s WHERE id IN (SELECT psc.id FROM "
+                       "project_sla_control AS psc %s)" % (table, changed),
+                       {'since': since})
+            cr.execute("INSERT INTO %s %s"
+                       % (table, self._select_sql(changed)),
+                       {'since': since})
+            # Rows of the SLA Controls deleted since the previous refresh
+            cr.execute("""
+                WITH deleted AS (
+                    DELETE FROM project_sla_control_deleted
+                    RETURNING control_id)
+                DELETE FROM %s WHERE id IN (SELECT control_id FROM deleted)
+                """ % table)
+        param_obj.set_param(cr, SUPERUSER_ID, REFRESH_PARAM,
+                            str(refresh_date))
+        return True
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from datetime import datetime, time
+
+from openerp import tools
+from openerp.osv import orm
+
+from .sla_calendar import cache_counters
+
+
+class ResourceCalendar(orm.Model):
+    _inherit = 'resource.calendar'
+
+    def _get_cache_signature(self, cr, uid, calendar_id, context=None):
+        """
+        Version of a working calendar, that changes whenever the calendar,
+        its attendances or its leaves are created, written or unlinked.
+        It is part of the cache keys, so that cached values of a modified
+        calendar are not used again, by any server process.
+        """
+        if not calendar_id:
+            return False
+        cr.execute("""
+            SELECT (SELECT write_date FROM resource_calendar
+                    WHERE id = %(id)s),
+                   att.last, att.count, lv.last, lv.count
+            FROM (SELECT max(write_date) AS last, count(*) AS count
+                  FROM resource_calendar_attendance
+                  WHERE calendar_id = %(id)s) AS att,
+                 (SELECT max(write_date) AS last, count(*) AS count
+                  FROM resource_calendar_leaves
+                  WHERE calendar_id = %(id)s) AS lv
+            """, {'id': calendar_id})
+        return tuple(cr.fetchone())
+
+    def _sla_day_intervals(self, cr, uid, calendar_id, resource_id, day, tz,
+                           signature):
+        """
+        Working intervals of a date, for a resource in timezone tz, as a
+        tuple of (start, end) datetimes. ``signature`` is the one of the
+        calendar, see ``_get_cache_signature``.
+        """
+        cache_counters['lookups'] += 1
+        return self._sla_day_intervals_cached(
+            cr, uid, calendar_id, resource_id, day, tz, signature)
+
+    @tools.ormcache(skiparg=3)
+    def _sla_day_intervals_cached(self, cr, uid, calendar_id, resource_id,
+                                  day, tz, signature):
+        # Cached per arguments after uid, all of them positional
+        cache_counters['misses'] += 1
+        intervals = self.get_working_intervals_of_day(
+            cr, uid, calendar_id,
+            start_dt=datetime.combine(day, time()),
+            compute_leaves=True,
+            resource_id=resource_id,
+            default_interval=(8, 16),
+            context={'tz': tz})
+        return tuple((i[0], i[1]) for i in intervals)
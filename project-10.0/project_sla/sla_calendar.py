@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+SLA working calendar arithmetic helpers.
+
+The working intervals of each day are cached by
+``resource.calendar._sla_day_intervals``, per calendar, resource and day,
+so that all the documents scheduled over the same days share the same
+calendar computation. The end date of each document is then found by
+walking those days:
+
+    periods = day_periods(intervals_of_day, start_date)
+    date_limit = period_end(periods, start_date, hours)
+
+The cache lookups and misses of this process are counted in
+``cache_counters``.
+"""
+
+from datetime import timedelta
+
+# Same limit as resource.calendar _schedule_hours, to avoid infinite loops
+MAX_DAYS = 1000
+
+# Working intervals cache lookups and misses, in this process
+cache_counters = {'lookups': 0, 'misses': 0}
+
+
+def cache_stats():
+    """ Return a printable summary of the working intervals cache usage """
+    lookups, misses = cache_counters['lookups'], cache_counters['misses']
+    hits = lookups - misses
+    ratio = lookups and 100.0 * hits / lookups or 0.0
+    return '%d hits, %d misses (%.1f%%)' % (hits, misses, ratio)
+
+
+def day_periods(intervals_of_day, start_date):
+    """
+    Generate the (start, end) working periods of the days from the one of
+    ``start_date``, given a function returning the working intervals of a
+    date.
+    """
+    day = start_date.date()
+    for i in range(MAX_DAYS):
+        for period in intervals_of_day(day):
+            yield period
+        day += timedelta(days=1)
+
+
+def period_end(periods, start_date, hours):
+    """
+    Return the datetime when ``hours`` working hours have passed since
+    ``start_date``, given a list of (start, end) working periods covering
+    them. Returns None if the periods are not enough.
+    """
+    remaining = hours * 3600.0
+    for begin, end in periods:
+        begin = max(begin, start_date)
+        if end <= begin:
+            continue
+        available = (end - begin).total_seconds()
+        if available >= remaining:
+            return begin + timedelta(seconds=remaining)
+        remaining -= available
+    return None
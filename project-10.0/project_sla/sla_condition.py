@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2013 Daniel Reis
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Compiled SLA Rule conditions.
+
+A condition such as ``obj.priority <= '2'`` is translated once, when
+possible, into an equivalent ORM domain, so that the documents meeting it
+can be selected with a single query. Other conditions are evaluated with
+``safe_eval`` for each document:
+
+    cond = SLACondition("obj.priority <= '2'", issue_model)
+    cond.domain  # ['|', ('priority', '=', False),
+                 #  ('priority', 'in', ['0', '1', '2'])]
+    cond.evaluate(doc)  # True or False
+
+Compiled conditions are cached by SLA Rule id and write date.
+"""
+
+import ast
+import operator
+
+from openerp.tools.safe_eval import safe_eval
+
+DOC_NAMES = ('o', 'obj', 'object')
+
+# Python comparison operators, with their ORM domain counterpart
+COMPARE_OPS = {
+    ast.Eq: ('=', operator.eq),
+    ast.NotEq: ('!=', operator.ne),
+    ast.Lt: ('<', operator.lt),
+    ast.LtE: ('<=', operator.le),
+    ast.Gt: ('>', operator.gt),
+    ast.GtE: ('>=', operator.ge),
+    ast.In: ('in', lambda a, b: a in b),
+    ast.NotIn: ('not in', lambda a, b: a not in b),
+}
+
+# Value read from the ORM for an empty (NULL) column, per field type
+NULL_VALUES = {'integer': 0, 'float': 0.0}
+
+# Field types that can be translated, with the operators they support
+DOMAIN_TYPES = {
+    'boolean': ('=', '!='),
+    'char': ('=', '!=', 'in', 'not in'),
+    'text': ('=', '!=', 'in', 'not in'),
+    'selection': ('=', '!=', '<', '<=', '>', '>=', 'in', 'not in'),
+    'integer': ('=', '!=', '<', '<=', '>', '>=', 'in', 'not in'),
+    'float': ('=', '!=', '<', '<=', '>', '>=', 'in', 'not in'),
+}
+
+
+class SLACondition(object):
+    """ A SLA Rule condition, compiled for a document model """
+
+    def __init__(self, condition, model):
+        self.condition = condition.strip()
+        self.domain = condition_to_domain(condition, model)
+
+    def evaluate(self, doc):
+        """ Evaluate the condition for a document browse record """
+        eval_context = {'o': doc, 'obj': doc, 'object': doc}
+        return bool(safe_eval(self.condition, eval_context))
+
+
+def _doc_field(node, model):
+    """ Return the stored column name for a ``obj.field`` node, or None """
+    if not (isinstance(node, ast.Attribute) and
+            isinstance(node.value, ast.Name) and
+            node.value.id in DOC_NAMES):
+        return None
+    column = model._columns.get(node.attr)
+    if (column is None or column._type not in DOMAIN_TYPES or
+            not getattr(column, '_classic_write', False)):
+        return None
+    return node.attr
+
+
+def _compare_to_domain(node, model):
+    if len(node.ops) != 1 or type(node.ops[0]) not in COMPARE_OPS:
+        return None
+    field = _doc_field(node.left, model)
+    if not field:
+        return None
+    try:
+        value = ast.literal_eval(node.comparators[0])
+    except ValueError:
+        return None
+    column = model._columns[field]
+    op, py_op = COMPARE_OPS[type(node.ops[0])]
+    if op not in DOMAIN_TYPES[column._type]:
+        return None
+    if op in ('in', 'not in'):
+        if not isinstance(value, (list, tuple, set)):
+            return None
+        value = list(value)
+    try:
+        null_match = py_op(NULL_VALUES.get(column._type, False), value)
+    except TypeError:
+        return None
+    if column._type == 'selection' and op in ('<', '<=', '>', '>='):
+        # Compare selection keys in Python: the database collation
+        # could order strings differently
+        if callable(column.selection):
+            return None
+        op, value = 'in', [k for k, _v in column.selection
+                           if k and py_op(k, value)]
+    leaf = (field, op, value)
+    if null_match:
+        return ['|', (field, '=', False), leaf]
+    if not null_match and op in ('!=', 'not in'):
+        return ['&', (field, '!=', False), leaf]
+    return [leaf]
+
+
+def _node_to_domain(node, model):
+    if isinstance(node, ast.BoolOp):
+        domains = [_node_to_domain(v, model) for v in node.values]
+        if any(d is None for d in domains):
+            return None
+        op = '&' if isinstance(node.op, ast.And) else '|'
+        res = [op] * (len(domains) - 1)
+        for domain in domains:
+            res += domain
+        return res
+    if isinstance(node, ast.Compare):
+        return _compare_to_domain(node, model)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        field = _doc_field(node.operand, model)
+        if field and model._columns[field]._type == 'boolean':
+            return [(field, '=', False)]
+        return None
+    field = _doc_field(node, model)
+    if field and model._columns[field]._type == 'boolean':
+        return [(field, '=', True)]
+    return None
+
+
+def condition_to_domain(condition, model):
+    """
+    Translate a SLA Rule condition into an equivalent ORM domain on
+    ``model``. Only comparisons of stored document fields with literal
+    values, combined with ``and``, ``or`` and ``not``, are supported.
+    Returns None if the condition can't be translated.
+    """
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except SyntaxError:
+        return None
+    return _node_to_domain(tree.body, model)
+
+
+def condition_fields(condition):
+    """ Return the set of document field names used in a condition """
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except SyntaxError:
+        return set()
+    return set(node.attr for node in ast.walk(tree)
+               if isinstance(node, ast.Attribute) and
+               isinstance(node.value, ast.Name) and
+               node.value.id in DOC_NAMES)
+
+
+_cache = {}
+
+
+def get_condition(cr, line, model):
+    """
+    Return the compiled condition of a SLA Rule browse record, cached by
+    (database, rule id) and invalidated when the rule's write date changes.
+    """
+    key = (cr.dbname, line.id)
+    cached = _cache.get(key)
+    if cached and cached[0] == line.write_date:
+        return cached[1]
+    compiled = SLACondition(line.condition, model)
+    _cache[key] = (line.write_date, compiled)
+    return compiled
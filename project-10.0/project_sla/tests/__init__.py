@@ -1,6 +1,16 @@
 from . import test_compute_sla_date
+from . import test_sla_condition
+from . import test_sla_write
+from . import test_sla_event
+from . import test_sla_sweep
+from . import test_sla_benchmark
 
 
 fast_suite = [
     test_compute_sla_date,
+    test_sla_condition,
+    test_sla_write,
+    test_sla_event,
+    test_sla_sweep,
+    test_sla_benchmark,
 ]
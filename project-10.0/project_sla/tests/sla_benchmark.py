@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+SLA engine benchmark harness.
+
+Generates a synthetic data set (projects with their own working calendar
+and leaves, SLA Definitions with conditional Rules, and issues) and times
+the main SLA engine operations, counting the queries each one runs:
+
+    bench = SLABenchmark(registry, cr, uid)
+    bench.generate(issues=10000, projects=20)
+    results = bench.run()
+    regressions = compare(results, load_baseline(path))
+
+Results are stored as JSON baselines, keyed by data set size, so that
+regressions in wall time or queries per document can be detected when the
+engine changes. Queries per document are also checked against the fixed
+``QUERY_BUDGETS``, which do not depend on a previous run:
+
+    regressions = check_budgets(results)
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime as dt, timedelta
+
+from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as DT_FMT
+
+_logger = logging.getLogger(__name__)
+
+# Rules of the generated SLA Definitions: (name, condition, limit, warn)
+RESOLUTION_RULES = [
+    ('High priority resolution', "obj.priority == '2'", 8, 4),
+    ('Normal priority resolution', "obj.priority >= '1'", 16, 8),
+    ('Resolution', '', 24, 16),
+]
+RESPONSE_RULES = [
+    ('Fast response', "obj.priority == '2' and obj.user_id", 2, 1),
+    ('Response', '', 8, 4),
+]
+# Maximum queries per document of each operation. Working calendars are
+# read once per day and project, whatever the number of documents: these
+# fixed costs are only amortized from BUDGET_MIN_SIZE documents
+QUERY_BUDGETS = {
+    'store_sla_control': 2.0,
+    'update_sla_states': 0.5,
+    'reapply_sla': 2.0,
+    'report': 0.05,
+    'report_refresh': 0.05,
+}
+BUDGET_MIN_SIZE = 10000
+
+
+def load_baseline(path):
+    """ Return the baselines stored in a JSON file, or {} """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, baseline, results):
+    """ Store the results as the baseline for their data set size """
+    baseline = dict(baseline)
+    baseline[str(results['size'])] = results
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+
+
+def compare(results, baseline, time_tolerance=0.5, query_tolerance=0.0):
+    """
+    Compare benchmark results with the baseline of the same data set size.
+    Returns a list of regression messages: operations whose wall time or
+    queries per document grew more than the given tolerance ratio.
+    """
+    reference = baseline.get(str(results['size']))
+    if not reference:
+        return []
+    regressions = []
+    for step, measure in sorted(results['steps'].items()):
+        ref = reference['steps'].get(step)
+        if not ref:
+            continue
+        if measure['seconds'] > ref['seconds'] * (1 + time_tolerance):
+            regressions.append(
+                '%s: %.2fs instead of %.2fs' % (
+                    step, measure['seconds'], ref['seconds']))
+        if (measure['queries_per_doc'] >
+                ref['queries_per_doc'] * (1 + query_tolerance)):
+            regressions.append(
+                '%s: %.3f queries per document instead of %.3f' % (
+                    step, measure['queries_per_doc'],
+                    ref['queries_per_doc']))
+    return regressions
+
+
+def check_budgets(results, budgets=None):
+    """
+    Compare benchmark results with the fixed query budgets. Returns a list
+    of regression messages: operations running more queries per document
+    than their budget. Data sets smaller than ``BUDGET_MIN_SIZE`` are not
+    checked.
+    """
+    if results['size'] < BUDGET_MIN_SIZE:
+        return []
+    budgets = QUERY_BUDGETS if budgets is None else budgets
+    regressions = []
+    for step, measure in sorted(results['steps'].items()):
+        budget = budgets.get(step)
+        if budget is not None and measure['queries_per_doc'] > budget:
+            regressions.append(
+                '%s: %.3f queries per document, over the budget of %.3f' % (
+                    step, measure['queries_per_doc'], budget))
+    return regressions
+
+
+class SLABenchmark(object):
+    """ Synthetic SLA data set generator and operation timer """
+
+    def __init__(self, registry, cr, uid, context=None):
+        self.registry = registry
+        self.cr = cr
+        self.uid = uid
+        self.context = context or {}
+        self.project_ids = []
+        self.contract_ids = []
+        self.issue_ids = []
+
+    def _create_calendar(self, index, leaves):
+        cal_obj = self.registry['resource.calendar']
+        leave_obj = self.registry['resource.calendar.leaves']
+        cr, uid = self.cr, self.uid
+        # Alternate calendar shapes, so that the calendar caches are not
+        # only exercised with a single schedule
+        hours = [(9, 13), (14, 18)] if index % 2 else [(8, 12), (13, 17)]
+        attendances = [
+            (0, 0, {'name': 'Day %d %02d-%02d' % (day, start, end),
+                    'dayofweek': str(day),
+                    'hour_from': start,
+                    'hour_to': end})
+            for day in range(5) for start, end in hours]
+        calendar_id = cal_obj.create(cr, uid, {
+            'name': 'SLA benchmark calendar %d' % index,
+            'attendance_ids': attendances,
+        }, context=self.context)
+        today = dt.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        for i in range(leaves):
+            day = today - timedelta(days=7 * i + index % 5)
+            leave_obj.create(cr, uid, {
+                'name': 'SLA benchmark leave %d' % i,
+                'calendar_id': calendar_id,
+                'date_from': day.strftime(DT_FMT),
+                'date_to': (day + timedelta(hours=23)).strftime(DT_FMT),
+            }, context=self.context)
+        return calendar_id
+
+    def _create_sla(self, name, field, rules):
+        sla_obj = self.registry['project.sla']
+        field_ids = self.registry['ir.model.fields'].search(
+            self.cr, self.uid, [('model', '=', 'project.issue'),
+                                ('name', '=', field)])
+        return sla_obj.create(self.cr, self.uid, {
+            'name': name,
+            'control_model': 'project.issue',
+            'control_field_id': field_ids[0],
+            'sla_line_ids': [
+                (0, 0, {'name': rule, 'sequence': 10 * (i + 1),
+                        'condition': condition,
+                        'limit_qty': limit, 'warn_qty': warn})
+                for i, (rule, condition, limit, warn) in enumerate(rules)],
+        }, context=self.context)
+
+    def generate(self, issues=10000, projects=10, leaves=10):
+        """
+        Generate ``projects`` projects, each with its own calendar with
+        ``leaves`` leave days and both SLA Definitions on its Contract, and
+        ``issues`` issues spread over them in the last 90 days.
+        Issues are inserted with a single query, without computing their
+        SLAs, so that large data sets can be generated quickly.
+        """
+        cr, uid = self.cr, self.uid
+        project_obj = self.registry['project.project']
+        started = time.time()
+        sla_ids = [
+            self._create_sla('SLA benchmark resolution', 'date_closed',
+                             RESOLUTION_RULES),
+            self._create_sla('SLA benchmark response', 'date_open',
+                             RESPONSE_RULES),
+        ]
+        for i in range(projects):
+            project_id = project_obj.create(cr, uid, {
+                'name': 'SLA benchmark project %d' % i,
+                'resource_calendar_id': self._create_calendar(i, leaves),
+            }, context=self.context)
+            project = project_obj.browse(cr, uid, project_id,
+                                         context=self.context)
+            project.analytic_account_id.write({'sla_ids': [(6, 0, sla_ids)]})
+            self.project_ids.append(project_id)
+            self.contract_ids.append(project.analytic_account_id.id)
+        now = dt.now()
+        cr.execute("""
+            INSERT INTO project_issue (
+                name, project_id, user_id, priority, active,
+                create_uid, create_date, write_uid, write_date,
+                date_open, date_closed)
+            SELECT 'SLA benchmark issue ' || n,
+                   (%(projects)s::int[])[1 + n %% %(count)s],
+                   CASE WHEN n %% 4 = 0 THEN NULL ELSE %(uid)s END,
+                   (n %% 3)::varchar,
+                   true, %(uid)s, d, %(uid)s, d,
+                   CASE WHEN n %% 2 = 0
+                        THEN d + (n %% 48) * interval '1 hour' END,
+                   CASE WHEN n %% 3 = 0
+                        THEN d + (n %% 120) * interval '1 hour' END
+            FROM (
+                SELECT n, %(now)s::timestamp
+                          - (n %% 90) * interval '1 day'
+                          - (n %% 24) * interval '1 hour' AS d
+                FROM generate_series(1, %(issues)s) AS n) AS s
+            RETURNING id
+            """, {'projects': self.project_ids, 'count': projects,
+                  'uid': uid, 'issues': issues, 'now': now.strftime(DT_FMT)})
+        self.issue_ids = [row[0] for row in cr.fetchall()]
+        self.registry['project.issue'].invalidate_cache(
+            cr, uid, context=self.context)
+        _logger.info('SLA benchmark: %d issues in %d projects generated '
+                     'in %.2fs', issues, projects, time.time() - started)
+        return True
+
+    def measure(self, step, docs, function, *args, **kwargs):
+        """ Run an operation, returning its wall time and query counts """
+        cr = self.cr
+        queries = cr.sql_log_count
+        started = time.time()
+        function(*args, **kwargs)
+        seconds = time.time() - started
+        queries = cr.sql_log_count - queries
+        res = {
+            'seconds': round(seconds, 3),
+            'queries': queries,
+            'queries_per_doc': round(float(queries) / max(docs, 1), 4),
+        }
+        _logger.info('SLA benchmark %s: %.2fs, %d queries '
+                     '(%.3f per document)', step, seconds, queries,
+                     res['queries_per_doc'])
+        return res
+
+    def run(self):
+        """ Time the SLA engine operations on the generated data set """
+        cr, uid, context = self.cr, self.uid, self.context
+        ctrl_obj = self.registry['project.sla.control']
+        contract_obj = self.registry['account.analytic.account']
+        report_obj = self.registry['project.sla.report']
+        materialized_obj = self.registry['project.sla.report.materialized']
+        issue_obj = self.registry['project.issue']
+        param_obj = self.registry['ir.config_parameter']
+        count = len(self.issue_ids)
+        steps = {}
+
+        docs = issue_obj.browse(cr, uid, self.issue_ids, context=context)
+        steps['store_sla_control'] = self.measure(
+            'store_sla_control', count, ctrl_obj.store_sla_control,
+            cr, uid, docs, context=context)
+
+        # Sweep all the past dates, as on the first scheduler run
+        param_obj.set_param(cr, uid, 'project_sla.sweep_date', '')
+        steps['update_sla_states'] = self.measure(
+            'update_sla_states', count, ctrl_obj.update_sla_states,
+            cr, uid, context=context)
+
+        steps['reapply_sla'] = self.measure(
+            'reapply_sla', count, contract_obj._reapply_sla,
+            cr, uid, self.contract_ids, recalc_closed=True, context=context)
+
+        def report():
+            report_obj.invalidate_cache(cr, uid, context=context)
+            report_obj.read_group(
+                cr, uid, [], ['total_count', 'achieved_perc', 'failed_perc'],
+                ['sla_name', 'date_month'], context=context)
+
+        steps['report'] = self.measure('report', count, report)
+        steps['report_refresh'] = self.measure(
+            'report_refresh', count, materialized_obj.refresh,
+            cr, uid, full=True, context=context)
+        return {
+            'size': count,
+            'projects': len(self.project_ids),
+            'date': dt.now().strftime(DT_FMT),
+            'steps': steps,
+        }
@@ -9,6 +9,8 @@ friday = thursday + dt_delta(days=1)
 monday = friday + dt_delta(days=3)
 
 thursday_8 = dt_combine(thursday, datetime.time(8))
+thursday_8_30 = dt_combine(thursday, datetime.time(8, 30))
+thursday_10_30 = dt_combine(thursday, datetime.time(10, 30))
 thursday_10 = dt_combine(thursday, datetime.time(10))
 thursday_15 = dt_combine(thursday, datetime.time(15))
 thursday_17 = dt_combine(thursday, datetime.time(17))
@@ -17,7 +19,9 @@ thursday_19 = dt_combine(thursday, datetime.time(19))
 friday_5 = dt_combine(friday, datetime.time(5))
 friday_9 = dt_combine(friday, datetime.time(9))
 friday_11 = dt_combine(friday, datetime.time(11))
+friday_17_30 = dt_combine(friday, datetime.time(17, 30))
 
+monday_9 = dt_combine(monday, datetime.time(9))
 monday_10 = dt_combine(monday, datetime.time(10))
 
 
@@ -32,18 +36,17 @@ class TestComputeSlaDate(TransactionCase):
         # Tests using 8-12 13-18 demo data calendar
         self.calendar_id = self.ref('resource.timesheet_group1')
 
+    def compute(self, date, hours, context=None):
+        # Calculation depend on timezone
+        # Use UTC if none is specified
+        if context is None:
+            context = {'tz': 'UTC'}
+        return self.model._compute_sla_date(
+            self.cr, self.uid, self.calendar_id, self.uid, date, hours,
+            context=context)
+
     def test_10(self):
-        cr, uid = self.cr, self.uid
-        model = self.model
-        calendar_id = self.calendar_id
-
-        def compute(date, hours, context=None):
-            # Calculation depend on timezone
-            # Use UTC if none is specified
-            if context is None:
-                context = {'tz': 'UTC'}
-            return model._compute_sla_date(
-                cr, uid, calendar_id, uid, date, hours, context=context)
+        compute = self.compute
 
         self.assertEquals(compute(thursday_8, 2), thursday_10)
 
@@ -66,4 +69,40 @@ class TestComputeSlaDate(TransactionCase):
         # correctly process weekends
         self.assertEquals(compute(thursday_15, 3 + 9 + 2), monday_10)
 
-    # TODO: test it with leaves
+    def test_20_start_within_hour(self):
+        compute = self.compute
+        # cached working periods are computed from the start of the hour
+        self.assertEquals(compute(thursday_8, 2), thursday_10)
+        self.assertEquals(compute(thursday_8_30, 2), thursday_10_30)
+        self.assertEquals(compute(friday_17_30, 1), monday_9 -
+                          datetime.timedelta(minutes=30))
+
+    def test_30_cache_invalidation(self):
+        compute = self.compute
+        cal_obj = self.registry['resource.calendar']
+        intervals_of_day = cal_obj.get_working_intervals_of_day
+        calls = []
+
+        def counted_intervals_of_day(*args, **kwargs):
+            calls.append(args)
+            return intervals_of_day(*args, **kwargs)
+
+        cal_obj.get_working_intervals_of_day = counted_intervals_of_day
+        try:
+            self.assertEquals(compute(thursday_17, 2), friday_9)
+            first_calls = len(calls)
+            self.assertEquals(compute(thursday_17, 2), friday_9)
+            # the second computation is served by the cache
+            self.assertEquals(len(calls), first_calls)
+            # a leave on friday must be honored by the next computation
+            self.registry['resource.calendar.leaves'].create(
+                self.cr, self.uid, {
+                    'name': 'Friday off',
+                    'calendar_id': self.calendar_id,
+                    'date_from': '2015-04-10 00:00:00',
+                    'date_to': '2015-04-10 23:59:59',
+                })
+            self.assertEquals(compute(thursday_17, 2), monday_9)
+            self.assertTrue(len(calls) > first_calls)
+        finally:
+            del cal_obj.get_working_intervals_of_day
@@ -0,0 +1,55 @@
+from openerp.tests.common import TransactionCase
+import logging
+import os
+import tempfile
+import unittest
+
+from .sla_benchmark import SLABenchmark, check_budgets, compare, \
+    load_baseline, save_baseline
+
+_logger = logging.getLogger(__name__)
+
+# Number of issues to generate; the benchmark is skipped when not set
+BENCHMARK_SIZE = int(os.environ.get('SLA_BENCHMARK_SIZE') or 0)
+BENCHMARK_PROJECTS = int(os.environ.get('SLA_BENCHMARK_PROJECTS') or 10)
+# Baselines are machine dependent: kept out of the module source tree
+BASELINE_PATH = os.environ.get('SLA_BENCHMARK_BASELINE') or os.path.join(
+    tempfile.gettempdir(), 'sla_benchmark_baseline.json')
+# Store the results as the new baseline instead of comparing with it
+BASELINE_UPDATE = bool(os.environ.get('SLA_BENCHMARK_UPDATE'))
+# Allowed wall time increase ratio; wall times depend on the machine
+TIME_TOLERANCE = float(os.environ.get('SLA_BENCHMARK_TIME_TOLERANCE') or 0.5)
+
+
+@unittest.skipUnless(BENCHMARK_SIZE, 'SLA_BENCHMARK_SIZE is not set')
+class TestSlaBenchmark(TransactionCase):
+    """ Benchmark the SLA engine on a generated data set, e.g. with
+    SLA_BENCHMARK_SIZE=100000, and check it against the query budgets and
+    the stored baseline
+    """
+
+    def test_10_benchmark(self):
+        bench = SLABenchmark(self.registry, self.cr, self.uid,
+                             context={'tz': 'UTC'})
+        bench.generate(issues=BENCHMARK_SIZE, projects=BENCHMARK_PROJECTS)
+        results = bench.run()
+
+        issue_obj = self.registry['project.issue']
+        computed = issue_obj.search(
+            self.cr, self.uid, [('id', 'in', bench.issue_ids),
+                                ('sla_state', '!=', False)], count=True)
+        self.assertEqual(computed, len(bench.issue_ids))
+        regressions = check_budgets(results)
+        self.assertFalse(regressions, 'SLA engine over query budgets:\n%s'
+                         % '\n'.join(regressions))
+
+        baseline = load_baseline(BASELINE_PATH)
+        if BASELINE_UPDATE or str(results['size']) not in baseline:
+            save_baseline(BASELINE_PATH, baseline, results)
+            _logger.info('SLA benchmark baseline stored in %s',
+                         BASELINE_PATH)
+            return
+        regressions = compare(results, baseline,
+                              time_tolerance=TIME_TOLERANCE)
+        self.assertFalse(regressions, 'SLA engine regressions:\n%s'
+                         % '\n'.join(regressions))
@@ -0,0 +1,56 @@
+from openerp.tests.common import TransactionCase
+
+from ..sla_condition import SLACondition, condition_to_domain
+
+
+class TestSlaCondition(TransactionCase):
+    """ Test SLA Rule condition compilation and domain translation
+    """
+
+    def setUp(self):
+        super(TestSlaCondition, self).setUp()
+        self.model = self.registry['project.issue']
+
+    def check_condition(self, condition):
+        """ The translated domain must select the same documents as the
+        condition evaluated in Python """
+        cr, uid = self.cr, self.uid
+        cond = SLACondition(condition, self.model)
+        self.assertIsNotNone(cond.domain, condition)
+        ids = self.model.search(cr, uid, [])
+        docs = self.model.browse(cr, uid, ids)
+        expected = set(d.id for d in docs if cond.evaluate(d))
+        found = set(self.model.search(
+            cr, uid, [('id', 'in', ids)] + cond.domain))
+        self.assertEqual(found, expected, condition)
+
+    def test_10_translated(self):
+        self.check_condition("obj.priority <= '1'")
+        self.check_condition("o.priority == '2'")
+        self.check_condition("object.priority in ('0', '2')")
+        self.check_condition("obj.priority != '2' and obj.active")
+        self.check_condition("obj.priority > '0' or not obj.active")
+
+    def test_20_not_translated(self):
+        for condition in ["obj.user_id.login == 'admin'",
+                          "obj.name.startswith('A')",
+                          "obj.priority <= obj.color",
+                          "obj.partner_id"]:
+            self.assertIsNone(
+                condition_to_domain(condition, self.model), condition)
+
+    def test_30_safe_eval_builtins(self):
+        """ Conditions can use all the builtins provided by safe_eval """
+        cr, uid = self.cr, self.uid
+        ids = self.model.search(cr, uid, [], limit=1)
+        if not ids:
+            self.skipTest('No issue to evaluate conditions on')
+        doc = self.model.browse(cr, uid, ids[0])
+        for condition in [
+                "sum(map(int, [obj.priority or '0'])) >= 0",
+                "isinstance(repr(obj.name), str)",
+                "long(len(dict(zip(range(2), 'ab')))) == 2",
+                "unicode(obj.priority or '') in (u'', u'0', u'1', u'2')",
+                "len(filter(None, [obj.active])) <= 1"]:
+            self.assertTrue(
+                SLACondition(condition, self.model).evaluate(doc), condition)
@@ -0,0 +1,125 @@
+from openerp.tests.common import TransactionCase
+from datetime import datetime as dt, timedelta
+
+
+class TestSlaEvent(TransactionCase):
+    """ Test the SLA clock is paused and resumed with the document's stage
+    """
+
+    def setUp(self):
+        super(TestSlaEvent, self).setUp()
+        cr, uid = self.cr, self.uid
+        self.model = self.registry['project.issue']
+        self.event_obj = self.registry['project.sla.event']
+        stage_obj = self.registry['project.task.type']
+        self.pause_stage_id = stage_obj.create(cr, uid, {
+            'name': 'Waiting for customer',
+            'sla_pause': True,
+        })
+        self.open_stage_id = self.ref('project.project_tt_analysis')
+        self.issue_id = self.model.create(cr, uid, {
+            'name': 'SLA pause test',
+            'project_id': self.ref('project.project_project_1'),
+            'stage_id': self.open_stage_id,
+        })
+
+    def last_event(self):
+        return self.event_obj.get_last_events(
+            self.cr, self.uid, 'project.issue', [self.issue_id])[
+                self.issue_id]
+
+    def limit_dates(self):
+        issue = self.model.browse(self.cr, self.uid, self.issue_id)
+        return [x.sla_limit_date for x in issue.sla_control_ids]
+
+    def states(self):
+        issue = self.model.browse(self.cr, self.uid, self.issue_id)
+        return [x.sla_state for x in issue.sla_control_ids]
+
+    def backdate(self, days):
+        """ Move the issue creation and its started event back in time,
+        with the control dates cleared """
+        self.cr.execute("""
+            UPDATE project_issue
+            SET create_date = create_date - %s * interval '1 day',
+                date_open = NULL, date_closed = NULL
+            WHERE id = %s""", (days, self.issue_id))
+        self.cr.execute("""
+            UPDATE project_sla_event
+            SET event_date = event_date - %s * interval '1 day'
+            WHERE doc_model = 'project.issue' AND doc_id = %s
+            """, (days, self.issue_id))
+        self.recompute()
+
+    def recompute(self):
+        cr, uid = self.cr, self.uid
+        self.model.invalidate_cache(cr, uid)
+        self.registry['project.sla.control'].store_sla_control(
+            cr, uid, self.model.browse(cr, uid, [self.issue_id]))
+        self.model.invalidate_cache(cr, uid)
+
+    def test_10_pause_resume(self):
+        cr, uid = self.cr, self.uid
+        self.assertEqual(self.last_event()[0], 'started')
+        self.assertTrue(all(self.limit_dates()))
+
+        self.model.write(cr, uid, [self.issue_id],
+                         {'stage_id': self.pause_stage_id})
+        event, _date, consumed = self.last_event()
+        self.assertEqual(event, 'paused')
+        self.assertGreaterEqual(consumed, 0.0)
+        self.assertFalse(any(self.limit_dates()))
+
+        # Staying in a pause stage doesn't log a new event
+        self.model.write(cr, uid, [self.issue_id],
+                         {'stage_id': self.pause_stage_id})
+        self.assertEqual(self.last_event()[0], 'paused')
+
+        self.model.write(cr, uid, [self.issue_id],
+                         {'stage_id': self.open_stage_id})
+        event, _date, resumed_consumed = self.last_event()
+        self.assertEqual(event, 'resumed')
+        self.assertEqual(resumed_consumed, consumed)
+        self.assertTrue(all(self.limit_dates()))
+        issue = self.model.browse(cr, uid, self.issue_id)
+        self.assertEqual([x.event for x in issue.sla_event_ids],
+                         ['started', 'paused', 'resumed'])
+
+    def test_20_close_after_limit(self):
+        cr, uid = self.cr, self.uid
+        self.backdate(60)
+        limits = self.limit_dates()
+        self.assertTrue(all(limits))
+        self.assertEqual(set(self.states()), set(['4']))
+
+        # Closed now, long after the limits: they are not moved to the
+        # close date, and the SLAs are failed
+        now = dt.now().replace(microsecond=0)
+        self.event_obj.log_events(cr, uid, 'project.issue', [
+            (self.issue_id, 'closed', now, 100.0)])
+        cr.execute("UPDATE project_issue SET date_open = %s, "
+                   "date_closed = %s WHERE id = %s",
+                   (now, now, self.issue_id))
+        self.recompute()
+        self.assertEqual(self.limit_dates(), limits)
+        self.assertEqual(set(self.states()), set(['5']))
+
+    def test_30_resume_overdue(self):
+        cr, uid = self.cr, self.uid
+        self.backdate(60)
+        limits = self.limit_dates()
+        issue = self.model.browse(cr, uid, self.issue_id)
+        warnings = [x.sla_warn_date for x in issue.sla_control_ids]
+
+        # Paused after the limits, then resumed: the warning and limit
+        # dates stay in the running segment where they were reached
+        now = dt.now().replace(microsecond=0)
+        self.event_obj.log_events(cr, uid, 'project.issue', [
+            (self.issue_id, 'paused', now - timedelta(days=20), 100.0),
+            (self.issue_id, 'resumed', now, 100.0)])
+        self.recompute()
+        self.assertEqual(self.limit_dates(), limits)
+        issue = self.model.browse(cr, uid, self.issue_id)
+        self.assertEqual(
+            [x.sla_warn_date for x in issue.sla_control_ids], warnings)
+        self.assertEqual(set(self.states()), set(['4']))
@@ -0,0 +1,75 @@
+from openerp.tests.common import TransactionCase
+from openerp.tools.misc import DEFAULT_SERVER_DATETIME_FORMAT as DT_FMT
+from openerp import SUPERUSER_ID
+from datetime import datetime as dt, timedelta
+
+from ..project_sla_control import SLA_SWEEP_PARAM
+
+
+class TestSlaSweep(TransactionCase):
+    """ Test the SLA states transitions made by the scheduled sweep
+    """
+
+    def setUp(self):
+        super(TestSlaSweep, self).setUp()
+        cr, uid = self.cr, self.uid
+        self.model = self.registry['project.issue']
+        self.ctrl_obj = self.registry['project.sla.control']
+        self.param_obj = self.registry['ir.config_parameter']
+        self.issue_id = self.model.create(cr, uid, {
+            'name': 'SLA sweep test',
+            'project_id': self.ref('project.project_project_1'),
+        })
+        issue = self.model.browse(cr, uid, self.issue_id)
+        self.assertTrue(issue.sla_control_ids)
+        self.ctrl_id = issue.sla_control_ids[0].id
+
+    def set_control(self, state, warn_date, limit_date):
+        self.cr.execute(
+            "UPDATE project_sla_control "
+            "SET sla_state = %s, sla_warn_date = %s, sla_limit_date = %s "
+            "WHERE id = %s", (state, warn_date.strftime(DT_FMT),
+                              limit_date.strftime(DT_FMT), self.ctrl_id))
+        self.ctrl_obj.invalidate_cache(self.cr, self.uid)
+
+    def sweep(self, since=None):
+        if since is not None:
+            self.param_obj.set_param(
+                self.cr, SUPERUSER_ID, SLA_SWEEP_PARAM, since)
+        self.ctrl_obj.update_sla_states(self.cr, self.uid)
+        self.ctrl_obj.invalidate_cache(self.cr, self.uid)
+        self.model.invalidate_cache(self.cr, self.uid)
+
+    def control_state(self):
+        return self.ctrl_obj.browse(
+            self.cr, self.uid, self.ctrl_id).sla_state
+
+    def test_10_transitions(self):
+        now = dt.utcnow()
+        # Warning date crossed: watching -> warning
+        self.set_control('2', now - timedelta(hours=1),
+                         now + timedelta(hours=1))
+        self.sweep(since='')
+        self.assertEqual(self.control_state(), '3')
+        # Limit date crossed just before the previous sweep, as committed
+        # by a transaction running at that time: warning -> will fail
+        self.set_control('3', now - timedelta(hours=1),
+                         now - timedelta(minutes=1))
+        self.sweep()
+        self.assertEqual(self.control_state(), '4')
+        issue = self.model.browse(self.cr, self.uid, self.issue_id)
+        self.assertEqual(issue.sla_state, '4')
+
+    def test_20_incremental(self):
+        now = dt.utcnow()
+        # Dates crossed well before the previous sweep are not looked at
+        # again: they are left to the document writes
+        self.set_control('2', now - timedelta(hours=3),
+                         now + timedelta(hours=1))
+        self.sweep(since=now.strftime(DT_FMT))
+        self.assertEqual(self.control_state(), '2')
+        # Dates not crossed yet don't change the state
+        self.set_control('2', now + timedelta(hours=1),
+                         now + timedelta(hours=2))
+        self.sweep(since='')
+        self.assertEqual(self.control_state(), '2')
@@ -0,0 +1,79 @@
+from openerp.tests.common import TransactionCase
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class TestSlaWrite(TransactionCase):
+    """ Test SLA recomputation is skipped on writes not touching SLA
+    relevant fields
+    """
+
+    def setUp(self):
+        super(TestSlaWrite, self).setUp()
+        cr, uid = self.cr, self.uid
+        self.model = self.registry['project.issue']
+        self.issue_id = self.model.create(cr, uid, {
+            'name': 'SLA write test',
+            'project_id': self.ref('project.project_project_1'),
+            'priority': '2',
+        })
+
+    def test_10_sla_depends(self):
+        depends = self.model._get_sla_depends(self.cr, self.uid)
+        # Fields used by the SLA Definitions and their Rules
+        for field in ['date_closed', 'date_open', 'priority']:
+            self.assertIn(field, depends)
+        # Fields used to find the applicable SLAs
+        for field in ['user_id', 'project_id', 'create_date']:
+            self.assertIn(field, depends)
+        self.assertNotIn('description', depends)
+
+    def test_20_write_latency(self):
+        """ Writes not touching SLA fields don't recompute the SLAs;
+        the latencies are logged for comparison """
+        cr, uid = self.cr, self.uid
+        count = 50
+        ctrl_obj = self.registry['project.sla.control']
+        store_sla_control = ctrl_obj.store_sla_control
+        calls = []
+
+        def counted_store_sla_control(*args, **kwargs):
+            calls.append(args)
+            return store_sla_control(*args, **kwargs)
+
+        def timed_writes(field, values):
+            del calls[:]
+            start = time.time()
+            for i in range(count):
+                self.model.write(cr, uid, [self.issue_id],
+                                 {field: values[i % len(values)]})
+            return (time.time() - start) / count, len(calls)
+
+        ctrl_obj.store_sla_control = counted_store_sla_control
+        try:
+            skipped, skipped_calls = timed_writes(
+                'description', ['first', 'second'])
+            recomputed, recomputed_calls = timed_writes(
+                'priority', ['1', '2'])
+        finally:
+            del ctrl_obj.store_sla_control
+        _logger.info(
+            'SLA write latency: %.2fms when recomputing, %.2fms when '
+            'skipped (%.2fms saved per write)', recomputed * 1000,
+            skipped * 1000, (recomputed - skipped) * 1000)
+        self.assertEqual(skipped_calls, 0)
+        self.assertEqual(recomputed_calls, count)
+
+    def test_30_resolve_sla_settings(self):
+        """ SLAs and calendar are resolved from the issue's Project """
+        cr, uid = self.cr, self.uid
+        ctrl_obj = self.registry['project.sla.control']
+        other_id = self.model.create(cr, uid, {'name': 'SLA resolve test'})
+        resolved = ctrl_obj._resolve_sla_settings(
+            cr, uid, self.model, [self.issue_id, other_id])
+        sla_ids, calendar_id = resolved[self.issue_id]
+        self.assertIn(self.ref('project_sla.sla_resolution'), sla_ids)
+        self.assertEqual(calendar_id, self.ref('project_sla.worktime_9_18'))
+        self.assertEqual(resolved[other_id], ((), False))